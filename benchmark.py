@@ -0,0 +1,467 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014 Stefan Walzer <sekti@gmx.net>
+#
+# This file is part of SixCells.
+#
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Benchmarks of the solver and of loading and saving levels.
+
+Usage: benchmark.py [options] [level files...]
+Without level files, the levels in corpus/ and synthetic huge boards are used.
+Every stage (loading, saving, solving) is timed and its peak memory measured.
+
+Options:
+  --repeat N       take the best time of N runs of each stage (default 3)
+  --solve-limit N  don't time solving levels of more than N cells (default 5000,
+                   which leaves out the 120x120 board; 0 for no limit)
+  --json FILE      also save the results to FILE
+  --compare FILE   show the times relative to results saved earlier with --json
+  --solvers        instead, compare the solver backends' time per step,
+                   and on the first step of a big board
+  --classes        instead, time the grouping of cells into equivalence classes
+                   on boards of up to 10000 cells
+  --grouped        instead, time the check of whether cells are all connected
+                   (util.all_grouped) against the previous version
+  --editor         instead, time the editor's queries of neighbors and members,
+                   the update of every item, saving,
+                   and the update of what a change to one cell affects,
+                   on big boards (needs Qt)
+  --hexcells       instead, measure the levels per second that the .hexcells
+                   format can be parsed and written at, and loaded and saved at
+                   (the given .hexcells files or those in corpus/)
+  --streaming      instead, compare the time and peak memory of loading big
+                   .sixcells and .sixcellz files gradually (level.load_file)
+                   and all at once (level.read_file, then level.load)"""
+
+from __future__ import division, print_function
+
+import sys
+import os.path
+import io
+import gc
+import collections
+import glob
+import json
+import random
+import platform
+import time
+import tempfile
+import shutil
+import argparse
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import level
+from level import Cell, Column, cos30
+import solver
+import util
+from util import *
+
+
+def synthetic_level(width, height, seed=0):
+    "A random level filling a `width` x `height` area of the grid"
+    rnd = random.Random(seed)
+    result = level.Level()
+    for x in range(width):
+        for y in range(x%2, height*2, 2):
+            if rnd.random()<0.1:
+                continue
+            it = Cell()
+            it.setX(x*cos30)
+            it.setY(y/2)
+            it.kind = Cell.full if rnd.random()<0.4 else Cell.empty
+            it.revealed = rnd.random()<0.2
+            if it.kind is Cell.empty:
+                it.show_info = rnd.choice([1, 1, 1, 2])
+            else:
+                it.show_info = rnd.choice([0, 0, 1])
+            result.addItem(it)
+    for x in range(width):
+        if rnd.random()<0.5:
+            it = Column()
+            it.setX(x*cos30)
+            it.setY((x%2-2)/2)
+            it.show_info = rnd.random()<0.3
+            result.addItem(it)
+    result.full_upd()
+    return result
+
+
+def solve_steps(lvl):
+    """Play the level like the player's "Solve Completely" does.
+    Return the time taken by each call to solver.solve, the number of calls
+    that the pairwise deductions made unnecessary and whether the level was solved."""
+    stats = solver.Stats()
+    steps, avoided = solver.solve_complete(lvl, stats=stats)
+    times = [sum(run['time'].values()) for run in stats.runs]
+    return times, avoided, lvl.remaining==0
+
+
+def backends():
+    yield 'native', solver.native
+    if solver.GLPK is not None:
+        del solver.solver
+        yield 'pulp', solver.get_solver()
+
+
+def bench_classes():
+    print("{:<24} {:>8} {:>10} {:>12}".format("level", "unknown", "ms", "us per cell"))
+    for size in [10, 20, 40, 70, 100, 110]:
+        lvl = synthetic_level(size, size)
+        lvl.prepare()
+        known = [cell for cell in lvl.cells if cell.kind is not Cell.unknown]
+        unknown = [cell for cell in lvl.cells if cell.kind is Cell.unknown]
+        durations = []
+        for _ in range(3):
+            start = time.time()
+            solver.equivalence_classes(unknown, known+lvl.columns)
+            durations.append(time.time()-start)
+        duration = min(durations)
+        print("{:<24} {:>8} {:>10.2f} {:>12.2f}".format(
+            'synthetic {0}x{0}'.format(size), len(unknown), duration*1000, duration/len(lvl.cells)*1e6
+        ))
+
+
+def _all_grouped_scan(items, key):
+    # The previous version of util.all_grouped, for comparison
+    try:
+        grouped = {next(iter(items))}
+    except StopIteration:
+        return True
+    anything_to_add = True
+    while anything_to_add:
+        anything_to_add = False
+        for a in items-grouped:
+            if any(key(a, b) for b in grouped):
+                anything_to_add = True
+                grouped.add(a)
+    return len(grouped)==len(items)
+
+def bench_grouped():
+    print("{:<24} {:>6} {:>12} {:>12} {:>14}".format("shape", "cells", "previous ms", "key ms", "neighbors ms"))
+    for shape in ['line', 'blob']:
+        for count in [6, 18, 100, 300]:
+            lvl = level.Level()
+            for i in range(count):
+                it = Cell()
+                if shape=='line':
+                    it.setY(i)
+                else:
+                    width = int(count**0.5)+1
+                    it.setX(i%width*cos30)
+                    it.setY(i//width+i%width%2/2)
+                lvl.addItem(it)
+            lvl.full_upd()
+            items = set(lvl.cells)
+            durations = []
+            for group in [
+                lambda: _all_grouped_scan(items, Cell.is_neighbor),
+                lambda: util.all_grouped(items, key=Cell.is_neighbor),
+                lambda: util.all_grouped(items, neighbors=lambda it: it.neighbors),
+            ]:
+                start = time.time()
+                for _ in range(max(1, 1000//count)):
+                    assert group()
+                durations.append((time.time()-start)/max(1, 1000//count))
+            print("{:<24} {:>6} {:>12.3f} {:>12.3f} {:>14.3f}".format(shape, count, *[d*1000 for d in durations]))
+
+
+def bench_editor():
+    # Qt is only needed here; it doesn't need a display either
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    from qt.widgets import QApplication
+    import editor
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    print("{:<24} {:>6} {:>12} {:>12} {:>12} {:>12} {:>12} {:>12}".format("level", "cells", "neighbors ms", "flower ms", "columns ms", "update ms", "save ms", "change ms"))
+    for size in [20, 40, 70]:
+        scene = editor.Scene()
+        level.load(level.save(synthetic_level(size, size))[0], scene, Cell=editor.Cell, Column=editor.Column)
+        cells = list(scene.all(editor.Cell))
+        times = []
+        for items, query in [
+            (cells, lambda it: list(it.neighbors)),
+            (cells, lambda it: list(it.flower_neighbors)),
+            (list(scene.all(editor.Column)), lambda it: list(it.members)),
+        ]:
+            start = time.time()
+            for it in items:
+                query(it)
+            times.append(time.time()-start)
+        start = time.time()
+        scene.full_upd()
+        times.append(time.time()-start)
+        # What the editor's Play does first
+        start = time.time()
+        editor.save(scene)
+        times.append(time.time()-start)
+        # Changing a cell, like clicking it does
+        changed = cells[::max(1, len(cells)//100)]
+        start = time.time()
+        for it in changed:
+            it.kind = Cell.empty if it.kind is Cell.full else Cell.full
+            scene.upd_dirty()
+        times.append((time.time()-start)/len(changed))
+        print("{:<24} {:>6} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f} {:>12.2f}".format(
+            'synthetic {0}x{0}'.format(size), len(cells), *[t*1000 for t in times]
+        ))
+
+
+def bench_hexcells(args):
+    files = args or sorted(glob.glob(here('corpus', '*.hexcells')))
+    print("{:<24} {:>6} {:>12} {:>12} {:>12} {:>12}".format("level", "items", "parse/s", "format/s", "load/s", "save/s"))
+    for fn in files:
+        with io.open(fn, encoding='utf-8') as f:
+            text = f.read()
+        parsed = level.parse_hexcells(text)
+        lvl = level.open_level(fn)
+        rates = []
+        for run in [
+            lambda: level.parse_hexcells(text),
+            lambda: level.format_hexcells(*parsed),
+            lambda: level.load_hexcells(io.StringIO(text), level.Level()),
+            lambda: level.save_hexcells(io.BytesIO(), lvl),
+        ]:
+            count = 0
+            start = time.time()
+            while count<10 or time.time()-start<0.5:
+                run()
+                count += 1
+            rates.append(count/(time.time()-start))
+        print("{:<24} {:>6} {:>12.0f} {:>12.0f} {:>12.0f} {:>12.0f}".format(
+            os.path.basename(fn), len(list(level.hexcells_items(parsed[3]))), *rates
+        ))
+
+
+def bench_streaming():
+    if tracemalloc is None:
+        print("Peak memory can't be measured without tracemalloc")
+    print("{:<24} {:>8} {:>10} {:>12} {:>12} {:>12} {:>12}".format("level", "format", "KiB", "gradual ms", "gradual KiB", "at once ms", "at once KiB"))
+    folder = tempfile.mkdtemp()
+    try:
+        for size in [60, 120, 200]:
+            lvl = synthetic_level(size, size)
+            for gz in [False, True]:
+                fn = os.path.join(folder, 'level.sixcell'+('z' if gz else 's'))
+                level.save_file(fn, lvl, gz=gz)
+                results = []
+                for run in [
+                    lambda: level.load_file(fn, level.Level(), gz=gz),
+                    lambda: level.load(level.read_file(fn, gz=gz), level.Level()),
+                ]:
+                    duration, peak = measure(lambda: None, lambda _: run(), 1)
+                    results += [duration*1000, (peak or 0)/1024]
+                print("{:<24} {:>8} {:>10.0f} {:>12.0f} {:>12.0f} {:>12.0f} {:>12.0f}".format(
+                    'synthetic {0}x{0}'.format(size), os.path.splitext(fn)[1], os.path.getsize(fn)/1024, *results
+                ))
+    finally:
+        shutil.rmtree(folder)
+
+
+def bench_solvers(args):
+    if args:
+        levels = [(fn, lambda fn=fn: level.open_level(fn)) for fn in args]
+    else:
+        levels = [
+            ('synthetic {0}x{0}'.format(size), lambda size=size: synthetic_level(size, size))
+            for size in [10, 20, 30, 40]
+        ]
+
+    print("{:<24} {:<8} {:>6} {:>8} {:>10} {:>10} {:>10}  {}".format("level", "solver", "steps", "avoided", "mean ms", "max ms", "total s", "solved"))
+    for name, backend in backends():
+        solver.solver = backend
+        for title, make in levels:
+            lvl = make()
+            lvl.prepare()
+            times, avoided, solved = solve_steps(lvl)
+            print("{:<24} {:<8} {:>6} {:>8} {:>10.2f} {:>10.2f} {:>10.3f}  {}".format(
+                title, name, len(times), avoided, sum(times)/len(times)*1000, max(times)*1000, sum(times), solved
+            ))
+
+    # The first step on a big board, after the simple deductions, is the hardest:
+    # a single problem of hundreds of classes whose backbone takes hundreds of searches
+    print()
+    print("{:<24} {:<8} {:>10} {:>12} {:>12} {:>10}".format("level", "solver", "variables", "invocations", "deductions", "ms"))
+    for name, backend in backends():
+        solver.solver = backend
+        for size in [] if args else [60]:
+            lvl = _simplified(synthetic_level(size, size))
+            stats = solver.Stats()
+            start = time.time()
+            list(solver.Session(lvl).solve(stats=stats))
+            run = stats.runs[-1]
+            print("{:<24} {:<8} {:>10} {:>12} {:>12} {:>10.0f}".format(
+                'synthetic {0}x{0}'.format(size), name, run.get('variables', 0), run.get('invocations', 0),
+                run.get('deductions', 0), (time.time()-start)*1000
+            ))
+
+
+def corpus():
+    "The bundled levels and synthetic huge boards, as (name, function that makes the level)"
+    for fn in sorted(glob.glob(here('corpus', '*'))):
+        yield os.path.basename(fn), lambda fn=fn: level.open_level(fn)
+    for size in [60, 120]:
+        yield 'synthetic {0}x{0}'.format(size), lambda size=size: synthetic_level(size, size)
+
+
+def _hexcells_text(lvl):
+    "The level in the .hexcells format, or None if it doesn't fit into it"
+    f = io.BytesIO()
+    try:
+        level.save_hexcells(f, lvl)
+    except ValueError:
+        return None
+    return f.getvalue().decode('utf-8')
+
+def _json_text(lvl):
+    f = io.StringIO()
+    level.save_file(f, lvl)
+    return f.getvalue()
+
+def _binary_data(lvl):
+    f = io.BytesIO()
+    level.save_binary(f, lvl)
+    return f.getvalue()
+
+def _simplified(lvl):
+    lvl.prepare()
+    propagator = solver.Propagator(lvl)
+    for cell, value in propagator.deductions():
+        lvl.reveal(cell)
+        propagator.reveal(cell)
+    return lvl
+
+def _solve_simple(lvl):
+    propagator = solver.Propagator(lvl)
+    for cell, value in propagator.deductions():
+        lvl.reveal(cell)
+        propagator.reveal(cell)
+
+def _prepared(lvl):
+    lvl.prepare()
+    return lvl
+
+def stages(make, solve=True):
+    """The stages measured for a level made by `make`,
+    as (name, setup, run), where run(setup()) is what is measured.
+    The solving stages are left out unless `solve`."""
+    if _hexcells_text(make()) is not None:
+        yield 'load_hexcells', lambda: io.StringIO(_hexcells_text(make())), lambda f: level.load_hexcells(f, level.Level())
+        yield 'save_hexcells', make, lambda lvl: level.save_hexcells(io.BytesIO(), lvl)
+    yield 'load', lambda: io.StringIO(_json_text(make())), lambda f: level.load_file(f, level.Level())
+    yield 'save', make, lambda lvl: level.save_file(io.StringIO(), lvl)
+    yield 'load_binary', lambda: io.BytesIO(_binary_data(make())), lambda f: level.load_binary(f, level.Level())
+    yield 'save_binary', make, lambda lvl: level.save_binary(io.BytesIO(), lvl)
+    if not solve:
+        return
+    yield 'solve_simple', lambda: _prepared(make()), _solve_simple
+    yield 'solve', lambda: _simplified(make()), lambda lvl: list(solver.Session(lvl).solve())
+
+
+def measure(setup, run, repeat):
+    """Return the best time of `repeat` runs in seconds
+    and the peak memory allocated during a run in bytes (None if it can't be measured)"""
+    times = []
+    for _ in range(repeat):
+        arg = setup()
+        gc.collect()
+        start = time.time()
+        run(arg)
+        times.append(time.time()-start)
+    peak = None
+    if tracemalloc is not None:
+        arg = setup()
+        gc.collect()
+        tracemalloc.start()
+        run(arg)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return min(times), peak
+
+
+def bench_suite(levels, repeat=3, json_file=None, compare_file=None, solve_limit=None):
+    previous = {}
+    if compare_file:
+        with io.open(compare_file, encoding='utf-8') as f:
+            for r in json.load(f)['results']:
+                previous[r['level'], r['stage']] = r['seconds']
+
+    results = []
+    print("{:<34} {:>6} {:<14} {:>10} {:>10} {:>8}".format("level", "cells", "stage", "ms", "peak KiB", "vs. old"))
+    for name, make in levels:
+        cells = len(make().cells)
+        for stage, setup, run in stages(make, solve_limit is None or cells<=solve_limit):
+            seconds, peak = measure(setup, run, repeat)
+            results.append(collections.OrderedDict([
+                ('level', name), ('cells', cells), ('stage', stage), ('seconds', seconds), ('peak_bytes', peak)
+            ]))
+            old = previous.get((name, stage))
+            print("{:<34} {:>6} {:<14} {:>10.2f} {:>10} {:>8}".format(
+                name, cells, stage, seconds*1000,
+                '-' if peak is None else '{:.0f}'.format(peak/1024),
+                '-' if not old else '{:.2f}x'.format(seconds/old),
+            ))
+
+    if json_file:
+        report = collections.OrderedDict([
+            ('python', platform.python_version()),
+            ('solver', repr(solver.get_solver())),
+            ('repeat', repeat),
+            ('results', results),
+        ])
+        with io.open(json_file, 'w', encoding='utf-8') as f:
+            f.write(unicode(json.dumps(report, indent=1)))
+
+
+def main(args):
+    parser = argparse.ArgumentParser(usage=__doc__.split('\n\n')[1])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--solve-limit', type=int, default=5000)
+    parser.add_argument('--json')
+    parser.add_argument('--compare')
+    parser.add_argument('--solvers', action='store_true')
+    parser.add_argument('--classes', action='store_true')
+    parser.add_argument('--grouped', action='store_true')
+    parser.add_argument('--editor', action='store_true')
+    parser.add_argument('--hexcells', action='store_true')
+    parser.add_argument('--streaming', action='store_true')
+    parser.add_argument('levels', nargs='*')
+    args = parser.parse_args(args)
+
+    if args.classes:
+        return bench_classes()
+    if args.grouped:
+        return bench_grouped()
+    if args.editor:
+        return bench_editor()
+    if args.hexcells:
+        return bench_hexcells(args.levels)
+    if args.streaming:
+        return bench_streaming()
+    if args.solvers:
+        return bench_solvers(args.levels)
+    if args.levels:
+        levels = [(fn, lambda fn=fn: level.open_level(fn)) for fn in args.levels]
+    else:
+        levels = corpus()
+    bench_suite(levels, args.repeat, args.json, args.compare, args.solve_limit or None)
+
+if __name__=='__main__':
+    main(sys.argv[1:])
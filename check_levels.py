@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014 Oleh Prypin <blaxpirit@gmail.com>
+#
+# This file is part of SixCells.
+#
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Checks whether levels can be solved completely, like "Solve Completely" in the player.
+
+Usage: check_levels.py [options] files, directories or patterns...
+Directories are searched for level files;
+patterns like levels/*.hexcells are expanded.
+A JSON report with an entry for each level is written to the standard output
+(or to --output); progress is shown on the standard error.
+
+Options:
+  -j N, --jobs N     check N levels at once (default: the number of CPUs)
+  --timeout SECONDS  give up on a level after this long (default 300)
+  -o FILE, --output FILE
+                     write the report to FILE"""
+
+from __future__ import division, print_function
+
+import sys
+import io
+import json
+import time
+import collections
+import multiprocessing
+import argparse
+
+import level
+import solver
+from util import *
+
+
+def check_level(args):
+    """Solve the level in the file completely.
+    Return a dict describing the outcome, suitable for JSON."""
+    fn, timeout = args
+    result = collections.OrderedDict([('file', fn)])
+    start = time.time()
+    deadline = start+timeout
+    def check():
+        if time.time()>deadline:
+            raise solver.Cancelled()
+    stats = solver.Stats()
+    try:
+        lvl = level.open_level(fn)
+        lvl.prepare()
+        result['cells'] = len(lvl.cells)
+        steps, avoided = solver.solve_complete(lvl, check=check, stats=stats)
+    except solver.Cancelled:
+        result['solvable'] = None
+        result['error'] = "timed out"
+    except AssertionError:
+        result['solvable'] = None
+        result['error'] = "wrong deduction"
+    except Exception as e:
+        result['solvable'] = None
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    else:
+        # If it identified all blue cells, it'll have the rest uncovered as well
+        result['solvable'] = lvl.remaining==0
+        result['unknown'] = sum(1 for cell in lvl.cells if cell.kind is level.Cell.unknown)
+        result['steps'] = steps
+        result['avoided'] = avoided
+    result['solver_calls'] = stats.report()['total'].get('invocations', 0)
+    result['time'] = time.time()-start
+    return result
+
+
+def main(args):
+    parser = argparse.ArgumentParser(usage=__doc__.split('\n\n')[1])
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('--timeout', type=float, default=300)
+    parser.add_argument('-o', '--output')
+    parser.add_argument('paths', nargs='+')
+    args = parser.parse_args(args)
+
+    files = [fn for root, fn in level.find_levels(args.paths)]
+    pool = multiprocessing.Pool(args.jobs)
+    results = []
+    try:
+        jobs = [(fn, args.timeout) for fn in files]
+        for result in pool.imap_unordered(check_level, jobs):
+            results.append(result)
+            if result['solvable'] is None:
+                outcome = result['error']
+            else:
+                outcome = "solvable" if result['solvable'] else "not solvable"
+            print("[{}/{}] {}: {} ({:.1f}s)".format(len(results), len(files), result['file'], outcome, result['time']), file=sys.stderr)
+    finally:
+        pool.terminate()
+    results.sort(key=lambda result: files.index(result['file']))
+
+    report = json.dumps(results, indent=1)
+    if args.output:
+        with io.open(args.output, 'w', encoding='utf-8') as f:
+            f.write(unicode(report))
+    else:
+        print(report)
+
+    return 0 if all(result['solvable'] for result in results) else 1
+
+if __name__=='__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -21,20 +21,10 @@ from __future__ import division, print_function
 __version__ = '1.1'
 
 import sys
-import os.path
 import math
 import collections
-import json
-import io
-import gzip
 
-try:
-    script_path = os.path.dirname(os.path.abspath(__FILE__))
-except NameError:
-    script_path = os.path.dirname(os.path.abspath(sys.argv[0]))
-
-def here(*args):
-    return os.path.join(script_path, *args)
+from util import *
 
 sys.path.insert(0, here('universal-qt'))
 import qt
@@ -43,12 +33,9 @@ from qt.core import QPointF, QUrl
 from qt.gui import QPolygonF, QPen, QColor, QDesktopServices
 from qt.widgets import QGraphicsPolygonItem, QGraphicsSimpleTextItem, QMessageBox, QGraphicsScene, QAction, QActionGroup
 
-from util import *
-
-
+import level
+from level import tau, cos30, hexcells_pos
 
-tau = 2*math.pi # 360 degrees is better than 180 degrees
-cos30 = math.cos(tau/12)
 
 class Color(object):
     yellow = QColor(255, 175, 41)
@@ -66,6 +53,7 @@ class Color(object):
     revealed_border = QColor(0, 255, 128)
     selection = qt.black
     proven = QColor(0, 160, 0)
+    stuck = QColor(255, 64, 64)
 
 
 no_pen = QPen(qt.transparent, 1e-10, qt.NoPen)
@@ -272,276 +260,43 @@ class Scene(QGraphicsScene):
             it.upd()
 
 
-def _save_common(j, it):
-    if it.value is not None:
-        j['value'] = it.value
-    if it.together is not None:
-        j['together'] = it.together
-    j['x'] = it.x()
-    j['y'] = it.y()
-
 def save(scene, resume=False):
-    cells = list(scene.all(Cell))[::-1]
-    columns = list(scene.all(Column))[::-1]
-
-    cells_j, columns_j = [], []
-    
-    for i, it in enumerate(cells):
-        j = collections.OrderedDict()
-        j['id'] = i
-        j['kind'] = 0 if it.kind is Cell.empty else 1 if it.kind is Cell.full else -1
-        neighbors = sorted(it.neighbors, key=lambda n: (angle(it, n)+0.01)%tau)
-        j['neighbors'] = [cells.index(x) for x in neighbors]
-        if it.show_info and it.value is not None:
-            if it.kind is Cell.empty:
-                j['members'] = j['neighbors']
-            else:
-                j['members'] = [cells.index(x) for x in it.members]
-        if it.revealed or (resume and getattr(it, 'revealed_resume', False)):
-            j['revealed'] = True
-        _save_common(j, it)
-        cells_j.append(j)
-    
-    for it in columns:
-        j = collections.OrderedDict()
-        if it.rotation()<-45: key = lambda it: it.x()
-        elif it.rotation()>45: key = lambda it: -it.x()
-        else: key = lambda it: it.y()
-        j['members'] = [cells.index(n) for n in sorted(it.members, key=key)]
-        _save_common(j, it)
-        j['angle'] = int(round(it.rotation()))
-        
-        columns_j.append(j)
-    
-    struct = collections.OrderedDict([('version', 1)])
-    if scene.title:
-        struct['title'] = scene.title
-    if scene.information:
-        struct['author'] = scene.author
-    if scene.information:
-        struct['information'] = scene.information
-    struct['cells'] = cells_j
-    struct['columns'] = columns_j
-
-    return (struct, cells, columns)
+    return level.save(scene, resume, Cell=Cell, Column=Column)
 
 def save_file(file, scene, resume=False, pretty=False, gz=False):
-    result, _, _ = save(scene, resume)
-
-    if isinstance(file, basestring):
-        file = (gzip.open if gz else io.open)(file, 'w')
-    if pretty:
-        result = json.dumps(result, indent=1, separators=(',', ': '), ensure_ascii=False)
-        # Edit the resulting JSON string to join together the numbers that are alone in a line
-        lines = result.splitlines(True)
-        for i, line in enumerate(lines):
-            if line.strip().rstrip(',').isdigit():
-                lines[i-1] = lines[i-1].rstrip()+('' if '[' in lines[i-1] else ' ')
-                lines[i] = line.strip()
-                lines[i+1] = lines[i+1].lstrip()
-        result = ''.join(lines)
-    else:
-        result = json.dumps(result, separators=(',', ':'), ensure_ascii=False)
-    file.write(result)
+    level.save_file(file, scene, resume, pretty, gz, Cell=Cell, Column=Column)
 
 
 def load(struct, scene, Cell=Cell, Column=Column):
-    by_id = [None]*len(struct['cells'])
-    
-    for j in struct['cells']:
-        it = Cell()
-        it.id = j['id']
-        by_id[it.id] = it
-        it.kind = [Cell.empty, Cell.full, Cell.unknown][j['kind']]
-        it._neighbors = j.get('neighbors')
-        it._members = j.get('members') or []
-        it.revealed = j.get('revealed', False)
-        it.together = j.get('together', j.get('together', None))
-        it.setX(j['x'])
-        it.setY(j['y'])
-        it.value = j.get('value')
-    for it in by_id:
-        try:
-            it.neighbors = [by_id[i] for i in it._neighbors]
-        except (TypeError, AttributeError): pass
-        del it._neighbors
-        try:
-            it.members = [by_id[i] for i in it._members]
-        except AttributeError: pass
-        del it._members
-        scene.addItem(it)
-    
-    for j in struct['columns']:
-        it = Column()
-        try:
-            it.members = [by_id[i] for i in j['members']]
-        except AttributeError: pass
-        it.together = j.get('together', j.get('together', None))
-        it.setX(j['x'])
-        it.setY(j['y'])
-        it.setRotation(j.get('angle') or 1e-3) # not zero so font doesn't look different from rotated variants
-        try:
-            it.value = j['value']
-        except AttributeError: pass
-        scene.addItem(it)
-    
-    scene.title = struct.get('title') or ''
-    scene.author = struct.get('author') or ''
-    scene.information = struct.get('information') or ''
-    
-    scene.full_upd()
-    return True
+    return level.load(struct, scene, Cell=Cell, Column=Column)
 
 def load_file(file, scene, Cell=Cell, Column=Column, gz=False):
-    if isinstance(file, basestring):
-        file = (gzip.open if gz else io.open)(file, 'rb')
-    jj = file.read()
-    if not isinstance(jj, unicode):
-        jj = jj.decode('utf-8')
     try:
-        jj = json.loads(jj)
-    except Exception as e:
+        return level.load_file(file, scene, Cell=Cell, Column=Column, gz=gz)
+    except ValueError as e:
         QMessageBox.warning(None, "Error", "Error while parsing JSON:\n{}".format(e))
         return False
-    load(jj, scene, Cell=Cell, Column=Column)
-    return True
 
 
-def hexcells_pos(x, y):
-    return int(round(x/cos30)), int(round(y*2))
+def save_binary(file, scene):
+    level.save_binary(file, scene, Cell=Cell, Column=Column)
 
+def load_binary(file, scene, Cell=Cell, Column=Column):
+    try:
+        level.load_binary(file, scene, Cell=Cell, Column=Column)
+    except ValueError as e:
+        QMessageBox.warning(None, "Error", "Error while reading the level:\n{}".format(e))
+        return False
+    return True
 
-hexcells_ui_area = [
-    '     *************************   ',
-    '     *#######################*   ',
-    '    *########################*   ',
-    '    *########################*   ',
-    '   *#########################*   ',
-    '   ##########################*   ',
-    '  *##########################****',
-    ' *###############################',
-    ' *###############################',
-    '*################################',
-    '*################################'
-]+[
-    '#'*33
-]*22
 
 def save_hexcells(file, scene):
-    grid = {}
-    for it in scene.all():
-        if isinstance(it, (Cell, Column)):
-            grid[hexcells_pos(it.x(), it.y())] = it
-    min_x, max_x = minmax([x for x, y in grid] or [0])
-    min_y, max_y = minmax([y for x, y in grid] or [0])
-    mid_x, mid_y = (min_x+max_x)//2, (min_y+max_y)//2
-    max_t = 32
-    mid_t = (0+max_t)//2
-
-    if max_x-min_x>max_t:
-        raise ValueError("This level is too wide to fit into Hexcells format")
-    if max_y-min_y>max_t:
-        raise ValueError("This level is too high to fit into Hexcells format")
-
-    mid_d = mid_t-mid_x, mid_t-mid_y
-
-    ui_area = list(hexcells_ui_area)
-    d = len(scene.information.splitlines())*2-2
-    if d>0:
-        ui_area[-d:] = [' '*33]*d
-
-    possibilities = []
-    for dy in range(-min_y, -min_y+max_t-(max_y-min_y)+1):
-        for dx in range(-min_x, -min_x+max_t-(max_x-min_x)+1):
-            overlaps = 0
-            for (x, y), it in grid.items():
-                c = ui_area[y+dy][x+dx]
-                if isinstance(it, Cell):
-                    overlaps += {'#': 0, '*': 0.9, ' ': 1}[c]
-                if isinstance(it, Column):
-                    overlaps += {'#': 0, '*': 0.001, ' ': 0.85}[c]
-            dist = (
-                sum(distance((mid_t, mid_t), (x+dx, y+dy), squared=True) for x, y in grid)/(len(grid) or 1)+
-                distance(mid_d, (dx, dy), squared=True)
-            )
-            possibilities.append((overlaps, dist, (dy, dx)))
-    assert possibilities
-    overlaps, _, (dy, dx) = min(possibilities)
-    if overlaps>0.8:
-        ret = "This level (barely) fits, but may overlap some UI elements of Hexcells."
-    else:
-        ret = True
-        
-    result = [[['.', '.'] for x in range(max_t+1)] for y in range(max_t+1)]
-    for (x, y), it in grid.items():
-        r = result[y+dy][x+dx]
-        if isinstance(it, Column):
-            r[0] = {-90: '>', -60: '\\', 0: '|', 60: '/', 90: '<'}[int(round(it.rotation()))]
-        else:
-            r[0] = 'x' if it.kind is Cell.full else 'o'
-        if it.value is not None:
-            if it.together is not None:
-                r[1] = 'c' if it.together else 'n'
-            else:
-                r[1] = '+'
-        if isinstance(it, Cell) and it.revealed:
-            r[0] = r[0].upper()
-    result = '\n'.join(''.join(''.join(part) for part in line) for line in result)
-    if isinstance(file, basestring):
-        file = io.open(file, 'wb')
-    file.write(b'Hexcells level v1'+b'\n')
-    file.write(scene.title.encode('utf-8')+b'\n')
-    file.write(scene.author.encode('utf-8')+b'\n')
-    file.write((b'\n' if '\n' not in scene.information else b'')+scene.information.encode('utf-8')+b'\n')
-    file.write(result.encode('utf-8'))
-    
-    return ret
+    return level.save_hexcells(file, scene, Cell=Cell, Column=Column)
 
 
 def load_hexcells(file, scene, Cell=Cell, Column=Column):
-    if isinstance(file, basestring):
-        file = io.open(file, encoding='utf-8')
-    
-    level = []
+    level.load_hexcells(file, scene, Cell=Cell, Column=Column)
 
-    header = file.readline().strip()
-    if header!='Hexcells level v1':
-        raise ValueError("Can read only Hexcells level v1")
-    
-    scene.title = file.readline().strip()
-    scene.author = file.readline().strip()
-    scene.information = '\n'.join(line for line in [file.readline().strip(), file.readline().strip()] if line)
-    
-    for y, line in enumerate(file):
-        line = line.strip().replace(' ', '')
-        
-        row = []
-        
-        for x in range(0, len(line)//2):
-            kind, value = line[x*2:x*2+2]
-            
-            if kind.lower() in 'ox':
-                item = Cell()
-            elif kind in '\\|/':
-                item = Column()
-            else:
-                continue
-            
-            item.setX(x*cos30)
-            item.setY(y/2)
-            
-            if isinstance(item, Cell):
-                item.kind = Cell.full if kind.lower()=='x' else Cell.empty
-                item.revealed = kind.isupper()
-                item.show_info = 0 if value=='.' else 1 if value=='+' else 2
-            else:
-                item.setRotation(-60 if kind=='\\' else 60 if kind=='/' else 1e-3)
-                item.show_info = False if value=='+' else True
-            
-            scene.addItem(item)
-        
-    scene.full_upd()
-    
 
 def about(title):
     try:
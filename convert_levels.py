@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014 Oleh Prypin <blaxpirit@gmail.com>
+#
+# This file is part of SixCells.
+#
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Converts levels between the .hexcells, .sixcells, .sixcellz and .sixcellb formats, like "Save As" in the editor,
+or puts them into a level pack.
+
+Usage: convert_levels.py [options] (-t FORMAT | -p FILE) files, directories or patterns...
+Directories are searched for level files;
+patterns like levels/*.hexcells are expanded.
+Each level is saved next to the original (or under --output-dir, keeping the
+layout of the given directories) with the extension of FORMAT.
+Outputs that were modified after their level are up to date and skipped.
+Levels whose output would replace the level itself are skipped.
+Progress is shown on the standard output, failures on the standard error.
+
+Options:
+  -t FORMAT, --to FORMAT
+                     hexcells, sixcells, sixcellz or sixcellb
+  -p FILE, --pack FILE
+                     instead, put the levels into one level pack (.sixcellp),
+                     which is up to date if it was modified after all of them
+  -d DIR, --output-dir DIR
+                     save the converted levels under DIR
+  -j N, --jobs N     convert N levels at once (default: the number of CPUs)
+  --compact          save JSON without the indentation that the editor uses
+  --hash             compare contents instead of modification times:
+                     convert every level, but only write outputs that change
+  -f, --force        convert the levels that are up to date as well"""
+
+from __future__ import division, print_function
+
+import sys
+import os
+import os.path
+import io
+import gzip
+import hashlib
+import collections
+import multiprocessing
+import argparse
+
+import level
+from util import *
+
+
+formats = ['hexcells', 'sixcells', 'sixcellz', 'sixcellb']
+
+
+def output_name(root, fn, format, output_dir=None):
+    name = os.path.splitext(fn)[0]+'.'+format
+    if output_dir is not None:
+        name = os.path.join(output_dir, os.path.relpath(name, root or '.'))
+    return name
+
+def read_output(fn):
+    "The contents of an output file (uncompressed), or None if it can't be read"
+    try:
+        with (gzip.open if fn.endswith('.sixcellz') else io.open)(fn, 'rb') as f:
+            return f.read()
+    except (IOError, OSError):
+        return None
+
+def convert_level(args):
+    """Convert the level in the file, unless the output is up to date.
+    Return a dict describing the outcome."""
+    fn, out, format, pretty, use_hash, force = args
+    result = collections.OrderedDict([('file', fn), ('output', out)])
+    if os.path.normcase(os.path.abspath(out))==os.path.normcase(os.path.abspath(fn)):
+        result['status'] = "skipped"
+        result['warning'] = "The level is already in this format"
+        return result
+    try:
+        if not force and not use_hash and os.path.exists(out) and os.path.getmtime(out)>=os.path.getmtime(fn):
+            result['status'] = "up to date"
+            return result
+        lvl = level.open_level(fn)
+        if format=='hexcells':
+            f = io.BytesIO()
+            r = level.save_hexcells(f, lvl)
+            if isinstance(r, basestring):
+                result['warning'] = r
+            data = f.getvalue()
+        elif format=='sixcellb':
+            data = level.struct_to_binary(level.save(lvl)[0])
+        else:
+            f = io.StringIO()
+            level.save_file(f, lvl, pretty=pretty)
+            data = f.getvalue().encode('utf-8')
+        if not force and use_hash:
+            old = read_output(out)
+            if old is not None and hashlib.sha1(old).digest()==hashlib.sha1(data).digest():
+                result['status'] = "up to date"
+                return result
+        if os.path.dirname(out) and not os.path.isdir(os.path.dirname(out)):
+            os.makedirs(os.path.dirname(out))
+        with (gzip.open if format=='sixcellz' else io.open)(out, 'wb') as f:
+            f.write(data)
+        result['status'] = "converted"
+    except Exception as e:
+        result['status'] = "failed"
+        result['error'] = str(e) if isinstance(e, ValueError) else '{}: {}'.format(type(e).__name__, e)
+    return result
+
+def pack_level(fn):
+    """Load the level in the file.
+    Return a dict describing the outcome, with the level in .sixcellb form as 'data'."""
+    result = collections.OrderedDict([('file', fn)])
+    try:
+        result['data'] = level.struct_to_binary(level.save(level.open_level(fn))[0])
+        result['status'] = "packed"
+    except Exception as e:
+        result['status'] = "failed"
+        result['error'] = str(e) if isinstance(e, ValueError) else '{}: {}'.format(type(e).__name__, e)
+    return result
+
+
+def make_pack(pack, files, jobs=None, use_hash=False, force=False):
+    "Put the levels in the files into a level pack, in this order; return the number of failures"
+    if not force and not use_hash and os.path.exists(pack) and all(os.path.getmtime(pack)>=os.path.getmtime(fn) for fn in files):
+        print("{}: up to date".format(pack))
+        return 0
+    pool = multiprocessing.Pool(jobs)
+    levels = []
+    failed = 0
+    try:
+        for i, result in enumerate(pool.imap(pack_level, files)):
+            print("[{}/{}] {}: {}".format(i+1, len(files), result['file'], result['status']))
+            if 'error' in result:
+                failed += 1
+                print("{}: {}".format(result['file'], result['error']), file=sys.stderr)
+            else:
+                levels.append(result['data'])
+    finally:
+        pool.terminate()
+
+    f = io.BytesIO()
+    level.save_pack(f, levels)
+    data = f.getvalue()
+    if not force and use_hash:
+        old = read_output(pack)
+        if old is not None and hashlib.sha1(old).digest()==hashlib.sha1(data).digest():
+            print("{}: up to date".format(pack))
+            return failed
+    with io.open(pack, 'wb') as f:
+        f.write(data)
+    print("{} levels packed into {}, {} failed".format(len(levels), pack, failed))
+    return failed
+
+
+def main(args):
+    parser = argparse.ArgumentParser(usage=__doc__.split('\n\n')[1])
+    parser.add_argument('-t', '--to', choices=formats)
+    parser.add_argument('-p', '--pack')
+    parser.add_argument('-d', '--output-dir')
+    parser.add_argument('-j', '--jobs', type=int, default=None)
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--hash', action='store_true')
+    parser.add_argument('-f', '--force', action='store_true')
+    parser.add_argument('paths', nargs='+')
+    args = parser.parse_args(args)
+    if (args.to is None)==(args.pack is None):
+        parser.error("either --to or --pack is needed")
+
+    if args.pack:
+        files = [fn for root, fn in level.find_levels(args.paths)]
+        return 1 if make_pack(args.pack, files, args.jobs, args.hash, args.force) else 0
+
+    jobs = [
+        (fn, output_name(root, fn, args.to, args.output_dir), args.to, not args.compact, args.hash, args.force)
+        for root, fn in level.find_levels(args.paths)
+    ]
+    pool = multiprocessing.Pool(args.jobs)
+    counts = collections.Counter()
+    try:
+        for result in pool.imap_unordered(convert_level, jobs):
+            counts[result['status']] += 1
+            print("[{}/{}] {} -> {}: {}".format(sum(counts.values()), len(jobs), result['file'], result['output'], result['status']))
+            if 'error' in result:
+                print("{}: {}".format(result['file'], result['error']), file=sys.stderr)
+            if 'warning' in result:
+                print("{}: {}".format(result['file'], result['warning']), file=sys.stderr)
+    finally:
+        pool.terminate()
+
+    print("{} converted, {} up to date, {} skipped, {} failed".format(counts['converted'], counts['up to date'], counts['skipped'], counts['failed']))
+    return 1 if counts['failed'] else 0
+
+if __name__=='__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -21,8 +21,8 @@
 from __future__ import division, print_function
 
 import sys
-import math
 import itertools
+import bisect
 import contextlib
 import weakref
 import io
@@ -30,8 +30,10 @@ import os.path
 
 import common
 from common import *
+import level
+import solver
 
-from qt.core import QPointF, QRectF, QSizeF, QTimer, QByteArray, QPoint
+from qt.core import QPointF, QRectF, QSizeF, QTimer, QByteArray, QPoint, QThread
 from qt.gui import QPolygonF, QPen, QPainter, QMouseEvent, QTransform, QPainterPath, QKeySequence, QClipboard, QIcon, QBrush
 from qt.widgets import QApplication, QGraphicsView, QMainWindow, QMessageBox, QFileDialog, QGraphicsItem, QGraphicsPathItem, QInputDialog, QAction, QActionGroup, QVBoxLayout, QDialog, QLineEdit, QDialogButtonBox, QLabel, QShortcut
 
@@ -43,8 +45,36 @@ class Cell(common.Cell):
         self._show_info = 0
         self.preview = None
         self.columns = weakref.WeakSet()
+        # Whether the last check found that this cell can't be deduced
+        self.stuck = False
+        # Position in the scene's grid index
+        self.grid_pos = None
+        self.invalidate()
 
         common.Cell.__init__(self)
+        self.setFlag(QGraphicsItem.ItemSendsGeometryChanges)
+
+    def itemChange(self, change, value):
+        # Keep the scene's grid index up to date,
+        # and have the numbers around the old and the new place updated.
+        # The cell being placed doesn't count until it is placed (see Scene.mouseReleaseEvent):
+        # it knows its place in the grid, but isn't in the index, so no one else sees it.
+        scene = self.scene()
+        if change in (QGraphicsItem.ItemSceneChange, QGraphicsItem.ItemPositionChange):
+            if scene:
+                if self is not scene.preview:
+                    scene.dirty_around(self)
+                scene.grid_remove(self)
+        elif change in (QGraphicsItem.ItemSceneHasChanged, QGraphicsItem.ItemPositionHasChanged):
+            self.invalidate()
+            if scene:
+                if self is scene.preview:
+                    self.grid_pos = hexcells_pos(self.x(), self.y())
+                else:
+                    scene.grid_add(self)
+                    scene.dirty_around(self)
+                    scene.dirty.add(self)
+        return common.Cell.itemChange(self, change, value)
 
     @event_property
     def show_info(self):
@@ -72,30 +102,37 @@ class Cell(common.Cell):
     def neighbors(self):
         if not self.scene():
             return
-        return (it for it in self.scene().collidingItems(self) if isinstance(it, Cell))
+        # The cells that collide with this one
+        return self.scene().cells_near(self, 1)
     
     @property
     def flower_neighbors(self):
         if not self.scene():
             return
-        poly = QPolygonF()
-        l = 1.7
-        for i in range(6):
-            a = i*tau/6
-            poly.append(QPointF(self.x()+l*math.sin(a), self.y()+l*math.cos(a)))
-        for it in self.scene().items(poly):
-            if isinstance(it, Cell) and it is not self:
-                yield it
+        for it in self.scene().cells_near(self, 2):
+            yield it
     
+    def invalidate(self):
+        "Forget the members and numbers, after a change to the cells around"
+        self._members = self._value = self._together = None
+
+    # The following are cached until `invalidate` is called,
+    # which the scene does for all the cells around one that changes (see Scene.dirty_around)
     @property
     def members(self):
-        return (self.flower_neighbors if self.kind is Cell.full else self.neighbors)
+        if not self.scene():
+            return []
+        if self._members is None:
+            self._members = list(self.flower_neighbors if self.kind is Cell.full else self.neighbors)
+        return self._members
 
     @property
     def together(self):
         if self.show_info==2:
-            full_items = {it for it in self.members if it.kind is Cell.full}
-            return all_grouped(full_items, key=Cell.is_neighbor)
+            if self._together is None:
+                full_items = {it for it in self.members if it.kind is Cell.full}
+                self._together = all_grouped(full_items, neighbors=lambda it: it.neighbors)
+            return self._together
     @together.setter
     def together(self, value):
         if value is not None:
@@ -106,7 +143,9 @@ class Cell(common.Cell):
     @property
     def value(self):
         if self.show_info:
-            return sum(1 for it in self.members if it.kind is Cell.full)
+            if self._value is None:
+                self._value = sum(1 for it in self.members if it.kind is Cell.full)
+            return self._value
     @value.setter
     def value(self, value):
         if value is not None:
@@ -130,27 +169,25 @@ class Cell(common.Cell):
         if not self.scene():
             return
         
+        if first:
+            self.scene().dirty_around(self)
+
         common.Cell.upd(self)
         
         if self.revealed:
             self.setBrush(Color.revealed_border)
+        elif self.stuck:
+            self.setBrush(Color.stuck)
         #pen = QPen(Color.revealed_border if self.revealed else Color.border, 0.03)
         #pen.setJoinStyle(qt.MiterJoin)
         #self.setPen(pen)
 
-        if first:
-            with self.upd_neighbors():
-                pass
-
     @contextlib.contextmanager
     def upd_neighbors(self):
-        neighbors = list(self.flower_neighbors)
-        scene = self.scene()
+        # The items around the cell as it was before the block are updated
+        # (and the ones around it after, if it is moved or added)
+        self.scene().dirty_around(self)
         yield
-        for it in neighbors:
-            it.upd(False)
-        for it in scene.all(Column):
-            it.upd()
 
     def mousePressEvent(self, e):
         if e.button()==qt.LeftButton and e.modifiers()&qt.ShiftModifier:
@@ -232,8 +269,6 @@ class Cell(common.Cell):
             return
         if self.scene().supress:
             return
-        if self.scene().selection:
-            self.scene().full_upd()
 
         if e.modifiers()&(qt.ShiftModifier|qt.AltModifier) or self.scene().selection:
             e.ignore()
@@ -265,12 +300,39 @@ class Cell(common.Cell):
 
 class Column(common.Column):
     def __init__(self):
+        # Key of the line in the scene's index of columns
+        self.line_key = None
+
         common.Column.__init__(self)
+        self.setFlag(QGraphicsItem.ItemSendsGeometryChanges)
         
         self._show_info = False
 
+    def itemChange(self, change, value):
+        # Keep the scene's index of columns up to date
+        scene = self.scene()
+        if change in (QGraphicsItem.ItemSceneChange, QGraphicsItem.ItemPositionChange, QGraphicsItem.ItemRotationChange):
+            if scene:
+                scene.column_remove(self)
+        elif change in (QGraphicsItem.ItemSceneHasChanged, QGraphicsItem.ItemPositionHasChanged, QGraphicsItem.ItemRotationHasChanged):
+            if scene:
+                scene.column_add(self)
+                scene.dirty.add(self)
+                scene.upd_timer.start()
+        return common.Column.itemChange(self, change, value)
+
     @property
     def members(self):
+        if not self.scene():
+            return []
+        try:
+            step = _line_steps[int(round(self.rotation()))]
+        except KeyError:
+            return self._members_in_shape()
+        return self.scene().line_cells(hexcells_pos(self.x(), self.y()), step)
+
+    def _members_in_shape(self):
+        # For directions that the scene doesn't index
         try:
             sr = self.scene().sceneRect()
         except AttributeError:
@@ -327,6 +389,16 @@ class Column(common.Column):
 
 
 
+# Direction of a column's line in the grid of hexcells_pos, by its angle.
+# Cells that overlap by half are on a vertical line too.
+_line_steps = {-60: (1, 1), 0: (0, 1), 60: (-1, 1)}
+
+def _line_key(pos, step):
+    "Identifies the line in the direction `step` that goes through the grid position `pos`"
+    (x, y), (sx, sy) = pos, step
+    return step, sy*x-sx*y
+
+
 def convert_pos(x, y):
     x = round(x/cos30)
     y = round(y*2)/2.0
@@ -341,6 +413,11 @@ def convert_pos(x, y):
 class Scene(common.Scene):
     def __init__(self):
         common.Scene.__init__(self)
+        # Items to update, once control returns to the event loop
+        self.upd_timer = QTimer()
+        self.upd_timer.setSingleShot(True)
+        self.upd_timer.setInterval(0)
+        self.upd_timer.timeout.connect(self.upd_dirty)
         self.reset()
         self.swap_buttons = False
         self.use_rightclick = False
@@ -348,12 +425,112 @@ class Scene(common.Scene):
     
     def reset(self):
         self.clear()
+        # Cells by their position in the grid (see hexcells_pos);
+        # there may be more than one only while a cell is being moved or placed
+        self.grid = {}
+        # For each line of the grid in the directions of columns (see _line_key),
+        # the cells on it from top to bottom: ([y of each cell], [cells])
+        self.lines = {}
+        # Columns by the key of the line they look along;
+        # ones in other directions are in other_columns
+        self.column_lines = {}
+        self.other_columns = set()
+        self.dirty = set()
         self.preview = None
         self.selection = set()
         self.selection_path_item = None
         self.supress = False
         self.title = self.author = self.information = ''
     
+    def full_upd(self):
+        # Everything is up to date after this
+        self.dirty = set()
+        common.Scene.full_upd(self)
+
+    def grid_add(self, cell):
+        cell.grid_pos = hexcells_pos(cell.x(), cell.y())
+        self.grid.setdefault(cell.grid_pos, []).append(cell)
+        y = cell.grid_pos[1]
+        for step in _line_steps.values():
+            ys, cells = self.lines.setdefault(_line_key(cell.grid_pos, step), ([], []))
+            i = bisect.bisect_right(ys, y)
+            ys.insert(i, y)
+            cells.insert(i, cell)
+
+    def grid_remove(self, cell):
+        cells = self.grid.get(cell.grid_pos, [])
+        if cell in cells:
+            cells.remove(cell)
+            if not cells:
+                del self.grid[cell.grid_pos]
+            for step in _line_steps.values():
+                key = _line_key(cell.grid_pos, step)
+                ys, cells = self.lines[key]
+                i = cells.index(cell)
+                del ys[i], cells[i]
+                if not cells:
+                    del self.lines[key]
+        cell.grid_pos = None
+
+    def column_add(self, col):
+        try:
+            step = _line_steps[int(round(col.rotation()))]
+        except KeyError:
+            self.other_columns.add(col)
+            return
+        col.line_key = _line_key(hexcells_pos(col.x(), col.y()), step)
+        self.column_lines.setdefault(col.line_key, set()).add(col)
+
+    def column_remove(self, col):
+        self.other_columns.discard(col)
+        cols = self.column_lines.get(col.line_key, set())
+        cols.discard(col)
+        if not cols:
+            self.column_lines.pop(col.line_key, None)
+        col.line_key = None
+
+    def dirty_around(self, cell):
+        "Have the numbers that may depend on `cell` updated, once control returns to the event loop"
+        if cell.grid_pos is None:
+            return
+        near = list(self.cells_near(cell, 2))
+        cell.invalidate()
+        for it in near:
+            it.invalidate()
+        self.dirty.update(near)
+        for step in _line_steps.values():
+            self.dirty.update(self.column_lines.get(_line_key(cell.grid_pos, step), ()))
+        self.dirty.update(self.other_columns)
+        self.upd_timer.start()
+
+    def upd_dirty(self):
+        dirty, self.dirty = self.dirty, set()
+        for it in dirty:
+            if it.scene() is not self:
+                continue
+            if isinstance(it, Cell):
+                it.upd(False)
+            else:
+                it.upd()
+
+    def line_cells(self, pos, step):
+        "The cells after the grid position `pos` on the line in the direction `step`, in order"
+        ys, cells = self.lines.get(_line_key(pos, step), ((), ()))
+        return cells[bisect.bisect_right(ys, pos[1]):]
+
+    def cells_near(self, cell, radius):
+        "Yield the other cells whose centers are at most `radius` away from `cell`'s"
+        x, y = cell.grid_pos
+        # The area of the grid that such cells can be in
+        rx, ry = int(radius/cos30+0.01), int(radius*2+0.01)
+        limit = (radius+0.01)**2
+        cx, cy = cell.x(), cell.y()
+        for dx in range(-rx, rx+1):
+            for dy in range(-ry, ry+1):
+                for it in self.grid.get((x+dx, y+dy), ()):
+                    if it is not cell and (it.x()-cx)**2+(it.y()-cy)**2<=limit:
+                        yield it
+
     def place(self, p, kind=Cell.unknown):
         if not self.preview:
             self.preview = Cell()
@@ -447,7 +624,12 @@ class Scene(common.Scene):
                     else:
                         with self.preview.upd_neighbors():
                             self.removeItem(self.preview)
-            self.preview = None
+            cell, self.preview = self.preview, None
+            if cell is not None and cell.scene() is self:
+                # It counts from now on
+                self.grid_add(cell)
+                self.dirty_around(cell)
+                self.dirty.add(cell)
         else:
             QGraphicsScene.mouseReleaseEvent(self, e)
     
@@ -524,8 +706,65 @@ class View(QGraphicsView):
         self.scale(d, d)
 
 
+class CheckThread(QThread):
+    "Plays a copy of the level in the background, for MainWindow's check of solvability"
+
+    def __init__(self, struct, cells):
+        QThread.__init__(self)
+        # The level as saved, and the cells in the order of their ids
+        self.struct = struct
+        self.cells = cells
+        self.cancelled = False
+        # Ids of the cells that the solver couldn't deduce, once finished
+        self.stuck = None
+        # The exception that ended the check, if it failed
+        self.error = None
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        if self.cancelled:
+            raise solver.Cancelled()
+
+    def run(self):
+        try:
+            lvl = level.Level()
+            level.load(self.struct, lvl)
+            lvl.prepare()
+            self.play(lvl)
+        except solver.Cancelled:
+            self.cancelled = True
+        except Exception as e:
+            # Nothing would catch it in this thread; MainWindow shows it
+            self.error = e
+
+    def play(self, lvl):
+        solver.solve_complete(lvl, check=self.check)
+        self.stuck = [it.id for it in lvl.cells if it.kind is Cell.unknown]
+
+
+class CountThread(CheckThread):
+    "Counts the solutions of a copy of the level in the background, for MainWindow.count_solutions"
+
+    def __init__(self, struct, limit):
+        CheckThread.__init__(self, struct, None)
+        self.limit = limit
+        # Once finished: the number of cells that the solver couldn't deduce,
+        # and the number of solutions at that point (see solver.count_solutions)
+        self.unknown = None
+        self.count = None
+
+    def play(self, lvl):
+        solver.solve_complete(lvl, check=self.check)
+        self.count = solver.count_solutions(lvl, self.limit, check=self.check)
+        self.unknown = sum(1 for it in lvl.cells if it.kind is Cell.unknown)
+
+
 class MainWindow(QMainWindow):
     title = "SixCells Editor"
+    # Seconds without changes after which the level is checked
+    check_delay = 0.5
     
     def __init__(self):
         QMainWindow.__init__(self)
@@ -538,13 +777,6 @@ class MainWindow(QMainWindow):
         self.view = View(self.scene)
         self.setCentralWidget(self.view)
         
-<<<<<<< HEAD
-        menu = self.menuBar().addMenu("&File")
-        menu.addAction("New", self.close_file, QKeySequence.New)
-        menu.addAction("Open...", self.load_file, QKeySequence.Open)
-        menu.addAction("Save", lambda: self.save_file(self.current_file), QKeySequence.Save)
-        menu.addAction("Save As...", self.save_file, QKeySequence('Ctrl+Shift+S'))
-=======
         self.statusBar()
         
         menu = self.menuBar().addMenu("&File")
@@ -556,7 +788,6 @@ class MainWindow(QMainWindow):
         action.setStatusTip("Save the level, overwriting the current file.")
         action = menu.addAction("Save &As...", self.save_file, QKeySequence('Ctrl+Shift+S'))
         action.setStatusTip("Save the level into a different file.")
->>>>>>> 868b26686564120805cc253ca55da70002e77369
         menu.addSeparator()
         action = menu.addAction("Set Level &Information", self.set_information, QKeySequence('Ctrl+D'))
         action.setStatusTip("Add or change the level's title, author's name and custom text hints.")
@@ -567,12 +798,8 @@ class MainWindow(QMainWindow):
         action = menu.addAction("&Quit", self.close, QKeySequence.Quit)
         action.setStatusTip("Close SixCells Editor.")
 
-<<<<<<< HEAD
-        menu = self.menuBar().addMenu("Preference&s")
-=======
 
         menu = self.menuBar().addMenu("&Preferences")
->>>>>>> 868b26686564120805cc253ca55da70002e77369
         
         self.swap_buttons_group = make_action_group(self, menu, self.scene, 'swap_buttons', [
             ("&Left Click Places Blue", False, "A blue cell will be placed when left mouse button is clicked. Black will then be the secondary color."),
@@ -610,22 +837,20 @@ class MainWindow(QMainWindow):
         action.setChecked(True)
         menu.addAction(action)
 
+        self.live_check_action = action = make_check_action("Check &Solvability While Editing", self, 'live_check')
+        action.setStatusTip("After each change, solve the level in the background and highlight the cells that can't be deduced.")
+        menu.addAction(action)
+
 
         menu = self.menuBar().addMenu("&Play")
-<<<<<<< HEAD
-        menu.addAction("From Start", self.play, QKeySequence('Ctrl+Tab'))
-        menu.addAction("Resume", lambda: self.play(resume=True), QKeySequence('Tab'))
-        
-        
-        menu = self.menuBar().addMenu("&Help")
-        menu.addAction("Instructions", help, QKeySequence.HelpContents)
-        menu.addAction("About", lambda: about(self.title))
-=======
         action = menu.addAction("From &Start", self.play, QKeySequence('Shift+Tab'))
         QShortcut(QKeySequence('Ctrl+Tab'), self, action.trigger)
         action.setStatusTip("Playtest this level from the beginning (discarding all progress).")
         action = menu.addAction("&Resume", lambda: self.play(resume=True), QKeySequence('Tab'))
         action.setStatusTip("Continue playtesting this level from where you left off.")
+        menu.addSeparator()
+        action = menu.addAction("Count &Solutions", self.count_solutions, QKeySequence('Ctrl+U'))
+        action.setStatusTip("Solve this level like the player's \"Solve Completely\" and check whether its solution is unique.")
         
         
         menu = self.menuBar().addMenu("&Help")
@@ -633,13 +858,22 @@ class MainWindow(QMainWindow):
         action.setStatusTip("View README on the project's webpage.")
         action = menu.addAction("&About", lambda: about(self.title))
         action.setStatusTip("About SixCells Editor.")
->>>>>>> 868b26686564120805cc253ca55da70002e77369
         
 
         self.current_file = None
         self.any_changes = False
         self.scene.changed.connect(self.changed)
 
+        self.check_thread = None
+        self.count_thread = None
+        # The level as it was last checked (see save)
+        self._checked_struct = None
+        self.check_timer = QTimer()
+        self.check_timer.setSingleShot(True)
+        self.check_timer.setInterval(int(self.check_delay*1000))
+        self.check_timer.timeout.connect(self._start_check)
+        self.live_check_action.setChecked(True)
+
         self.last_used_folder = None
         self.swap_buttons = False
         self.default_author = None
@@ -658,6 +892,7 @@ class MainWindow(QMainWindow):
         default_black = next(v for v, a in black_show_info_group.items() if a.isChecked()); black_show_info_group[v].setChecked(True)
         default_blue = next(v for v, a in blue_show_info_group.items() if a.isChecked()); blue_show_info_group[v].setChecked(True)
         status_bar = enable_statusbar_action.isChecked(); enable_statusbar_action.setChecked(v)
+        live_check = live_check_action.isChecked(); live_check_action.setChecked(v)
         default_author
         last_used_folder
         window_geometry_qt = save_geometry_qt(); restore_geometry_qt(v)
@@ -671,6 +906,9 @@ class MainWindow(QMainWindow):
     def changed(self, rects=None):
         if rects is None or any((rect.width() or rect.height()) for rect in rects):
             self.any_changes = True
+            if self.live_check:
+                # Wait for the changes to settle
+                self.check_timer.start()
     def no_changes(self):
         self.any_changes = False
         def no_changes():
@@ -720,6 +958,8 @@ class MainWindow(QMainWindow):
             elif btn==QMessageBox.Discard:
                 result = True
         if result:
+            self.cancel_check(wait=True)
+            self.cancel_count(wait=True)
             self.current_file = None
             self.scene.reset()
             self.no_changes()
@@ -779,7 +1019,7 @@ class MainWindow(QMainWindow):
             except AttributeError:
                 dialog = QFileDialog.getSaveFileName
             fn, _ = dialog(self, "Save", self.last_used_folder,
-                "Hexcells level (*.hexcells);;SixCells format (JSON) (*.sixcells);;SixCells format (JSON, gzipped) (*.sixcellz)"
+                "Hexcells level (*.hexcells);;SixCells format (JSON) (*.sixcells);;SixCells format (JSON, gzipped) (*.sixcellz);;SixCells format (binary) (*.sixcellb)"
             )
         if not fn:
             return
@@ -798,11 +1038,14 @@ class MainWindow(QMainWindow):
                 QMessageBox.critical(None, "Error", str(e))
                 self.status = "Failed", 1
                 return
-        try:
-            gz = fn.endswith('.sixcellz')
-        except AttributeError:
-            gz = False
-        save_file(fn, self.scene, pretty=True, gz=gz)
+        if fn.endswith('.sixcellb'):
+            save_binary(fn, self.scene)
+        else:
+            try:
+                gz = fn.endswith('.sixcellz')
+            except AttributeError:
+                gz = False
+            save_file(fn, self.scene, pretty=True, gz=gz)
         self.no_changes()
         self.current_file = fn
         self.last_used_folder = os.path.dirname(fn)
@@ -815,7 +1058,7 @@ class MainWindow(QMainWindow):
                 dialog = QFileDialog.getOpenFileNameAndFilter
             except AttributeError:
                 dialog = QFileDialog.getOpenFileName
-            fn, _ = dialog(self, "Open", self.last_used_folder, "Hexcells/SixCells Level (*.hexcells *sixcells *.sixcellz)")
+            fn, _ = dialog(self, "Open", self.last_used_folder, "Hexcells/SixCells Level (*.hexcells *sixcells *.sixcellz *.sixcellb)")
         if not fn:
             return
         if not self.close_file():
@@ -828,6 +1071,8 @@ class MainWindow(QMainWindow):
                 QMessageBox.critical(None, "Error", str(e))
                 self.status = "Failed", 1
                 return
+        elif fn.endswith('.sixcellb'):
+            load_binary(fn, self.scene, Cell=Cell, Column=Column)
         else:
             load_file(fn, self.scene, gz=fn.endswith('.sixcellz'), Cell=Cell, Column=Column)
         for it in self.scene.all(Column):
@@ -891,6 +1136,121 @@ class MainWindow(QMainWindow):
         window.show()
         QTimer.singleShot(0, delayed)
     
+    solution_count_limit = 1000
+
+    def count_solutions(self):
+        "Count the solutions in the background; if that is already going on, stop it"
+        if self.count_thread is not None:
+            self.cancel_count()
+            return
+        self.count_thread = CountThread(save(self.scene)[0], self.solution_count_limit)
+        self.count_thread.finished.connect(self._count_finished)
+        self.count_thread.start()
+        self.status = "Counting solutions... (Ctrl+U again to stop)"
+
+    def _count_finished(self):
+        thread = self.count_thread
+        if thread is None or self.sender() is not thread:
+            return
+        self.count_thread = None
+        if thread.cancelled:
+            self.status = "Stopped counting solutions", 1
+            return
+        if thread.error is not None:
+            self.status = "Failed to count solutions: {}: {}".format(type(thread.error).__name__, thread.error)
+            return
+        if not thread.unknown:
+            msg = "This level can be solved completely, so its solution is unique."
+        else:
+            msg = "The solver gets stuck with {} cells left unknown. At that point, {}{} solutions are possible.".format(
+                thread.unknown, "at least " if thread.count>=thread.limit else "", thread.count
+            )
+        self.status = "Done", 1
+        QMessageBox.information(None, "Solutions", msg)
+
+    def cancel_count(self, wait=False):
+        "Stop counting solutions; with `wait`, don't return until the thread has stopped"
+        thread = self.count_thread
+        if thread is None:
+            return
+        thread.cancel()
+        if wait:
+            thread.wait()
+            self.count_thread = None
+
+    @setter_property
+    def live_check(self, value):
+        yield value
+        if value:
+            self.check_timer.start()
+        else:
+            self.cancel_check()
+            self.show_stuck([])
+
+    def _start_check(self):
+        "Check whether the level can be solved completely, in the background"
+        if self.scene.preview or self.scene.selection:
+            # In the middle of placing or dragging
+            self.check_timer.start()
+            return
+        struct, cells, columns = save(self.scene)
+        if struct==self._checked_struct:
+            # Only the looks have changed
+            return
+        if self.check_thread is not None:
+            # Checking an old version of the level; try again when it has stopped
+            self.check_thread.cancel()
+            self.check_timer.start()
+            return
+        self._checked_struct = struct
+        self.check_thread = CheckThread(struct, cells)
+        self.check_thread.finished.connect(self._check_finished)
+        self.check_thread.start()
+
+    def _check_finished(self):
+        thread = self.check_thread
+        if thread is None or self.sender() is not thread:
+            return
+        self.check_thread = None
+        if thread.cancelled:
+            self._checked_struct = None
+            return
+        if thread.error is not None:
+            self.show_stuck([])
+            self.status = "Failed to check the level: {}: {}".format(type(thread.error).__name__, thread.error)
+            return
+        self.show_stuck([thread.cells[i] for i in thread.stuck])
+        if thread.stuck:
+            self.status = "{} cells can't be deduced".format(len(thread.stuck))
+        else:
+            self.status = "The level can be solved completely", 3
+
+    def cancel_check(self, wait=False):
+        "Stop checking; with `wait`, don't return until the thread has stopped"
+        self.check_timer.stop()
+        self._checked_struct = None
+        thread = self.check_thread
+        if thread is None:
+            return
+        thread.cancel()
+        if wait:
+            thread.wait()
+            self.check_thread = None
+
+    def show_stuck(self, cells):
+        "Highlight `cells` (and only them) as ones that can't be deduced"
+        any_changes = self.any_changes
+        cells = set(cells)
+        for it in self.scene.all(Cell):
+            stuck = it in cells
+            if it.stuck!=stuck:
+                it.stuck = stuck
+                it.upd(False)
+        # Highlighting is not a change of the level
+        def restore():
+            self.any_changes = any_changes
+        QTimer.singleShot(0, restore)
+
     def closeEvent(self, e):
         if not self.close_file():
             e.ignore()
@@ -0,0 +1,1028 @@
+# Copyright (C) 2014 Oleh Prypin <blaxpirit@gmail.com>
+#
+# This file is part of SixCells.
+#
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Level model and loaders that don't depend on Qt"""
+# Used by the solver and for batch work in processes without a display.
+
+from __future__ import division, print_function
+
+import sys
+import math
+import re
+import itertools
+import collections
+import json
+import io
+import codecs
+import os.path
+import glob
+import gzip
+import mmap
+import array
+from struct import Struct
+
+from util import *
+
+
+
+tau = 2*math.pi # 360 degrees is better than 180 degrees
+cos30 = math.cos(tau/12)
+
+
+def hexcells_pos(x, y):
+    return int(round(x/cos30)), int(round(y*2))
+
+
+# Offsets in the grid of hexcells_pos, clockwise starting from the top
+_neighbor_offsets = [(0, -2), (1, -1), (1, 1), (0, 2), (-1, 1), (-1, -1)]
+_flower_offsets = _neighbor_offsets+[
+    (0, -4), (1, -3), (2, -2), (2, 0), (2, 2), (1, 3),
+    (0, 4), (-1, 3), (-2, 2), (-2, 0), (-2, -2), (-1, -3)
+]
+# Direction of a column's line, by its angle
+_column_steps = {-60: (1, 1), 0: (0, 2), 60: (-1, 1)}
+
+
+class Cell(object):
+    "Hexagonal cell, only the data"
+    unknown = None
+    empty = False
+    full = True
+
+    __slots__ = ('id', 'kind', 'actual', 'revealed', 'value', 'together', 'show_info', 'neighbors', 'members', '_x', '_y')
+
+    def __init__(self):
+        self.id = None
+        self.kind = Cell.unknown
+        self.actual = Cell.unknown
+        self.revealed = False
+        self.value = None
+        self.together = None
+        self.show_info = None
+        self.neighbors = None
+        self.members = []
+        self._x = self._y = 0.0
+
+    def x(self):
+        return self._x
+    def y(self):
+        return self._y
+    def setX(self, value):
+        self._x = value
+    def setY(self, value):
+        self._y = value
+
+    def is_neighbor(self, other):
+        return other in self.neighbors
+
+
+class Column(object):
+    "Column number, only the data"
+    __slots__ = ('members', 'value', 'together', 'show_info', '_x', '_y', '_rotation')
+
+    def __init__(self):
+        self.members = None
+        self.value = None
+        self.together = None
+        self.show_info = None
+        self._x = self._y = self._rotation = 0.0
+
+    def x(self):
+        return self._x
+    def y(self):
+        return self._y
+    def setX(self, value):
+        self._x = value
+    def setY(self, value):
+        self._y = value
+    def rotation(self):
+        return self._rotation
+    def setRotation(self, value):
+        self._rotation = value
+
+
+class Level(object):
+    """Cells and columns of a level.
+    Can be used in place of a scene by the loaders and by the solver."""
+    def __init__(self):
+        self.cells = []
+        self.columns = []
+        self.title = self.author = self.information = ''
+        self.remaining = 0
+
+    @property
+    def all_cells(self):
+        return self.cells
+
+    @property
+    def all_columns(self):
+        return self.columns
+
+    def all(self, types=(Cell, Column)):
+        return (it for it in itertools.chain(self.cells, self.columns) if isinstance(it, types))
+
+    def addItem(self, it):
+        if isinstance(it, Column):
+            self.columns.append(it)
+        else:
+            if it.id is None:
+                it.id = len(self.cells)
+            self.cells.append(it)
+
+    def full_upd(self):
+        """Find neighbors, members and numbers of the items that don't have them,
+        based on their positions (this is the case for .hexcells levels)."""
+        # Nothing to do for levels that were saved with all of it
+        if all(it.neighbors is not None and it.show_info is None for it in self.cells):
+            if all(it.members is not None for it in self.columns):
+                return
+        grid = {hexcells_pos(it.x(), it.y()): it for it in self.cells}
+
+        for it in self.cells:
+            if it.neighbors is None:
+                x, y = hexcells_pos(it.x(), it.y())
+                it.neighbors = [grid[x+dx, y+dy] for dx, dy in _neighbor_offsets if (x+dx, y+dy) in grid]
+        for it in self.cells:
+            if it.show_info is None:
+                continue
+            if it.kind is Cell.full:
+                x, y = hexcells_pos(it.x(), it.y())
+                it.members = [grid[x+dx, y+dy] for dx, dy in _flower_offsets if (x+dx, y+dy) in grid]
+            else:
+                it.members = list(it.neighbors)
+            if it.show_info:
+                full_items = {m for m in it.members if m.kind is Cell.full}
+                it.value = len(full_items)
+                if it.show_info==2:
+                    it.together = all_grouped(full_items, neighbors=lambda m: m.neighbors)
+            it.show_info = None
+
+        # Without cells, the columns still get their (empty) members
+        max_y = max(y for x, y in grid) if grid else None
+        for it in self.columns:
+            if it.members is not None:
+                continue
+            x, y = hexcells_pos(it.x(), it.y())
+            dx, dy = _column_steps[int(round(it.rotation()))]
+            it.members = []
+            while max_y is not None and y<max_y:
+                x, y = x+dx, y+dy
+                try:
+                    it.members.append(grid[x, y])
+                except KeyError:
+                    pass
+            it.value = sum(1 for m in it.members if m.kind is Cell.full)
+            if it.show_info:
+                groups = itertools.groupby(it.members, key=lambda m: m.kind is Cell.full)
+                it.together = sum(1 for kind, _ in groups if kind)<=1
+            it.show_info = None
+
+    def prepare(self):
+        """Hide the cells that aren't revealed, as the player does when a level is started.
+        The solution stays available in `actual`."""
+        self.remaining = 0
+        for it in self.cells:
+            if it.kind is not Cell.unknown:
+                it.actual = it.kind
+            if not it.revealed:
+                if it.actual is Cell.full:
+                    self.remaining += 1
+                it.kind = Cell.unknown
+
+    def reveal(self, cell):
+        "Uncover a cell that was hidden by `prepare`"
+        cell.kind = cell.actual
+        if cell.kind is Cell.full:
+            self.remaining -= 1
+
+
+def _save_common(j, it):
+    if it.value is not None:
+        j['value'] = it.value
+    if it.together is not None:
+        j['together'] = it.together
+    j['x'] = it.x()
+    j['y'] = it.y()
+
+def save(scene, resume=False, Cell=Cell, Column=Column):
+    cells = list(scene.all(Cell))[::-1]
+    columns = list(scene.all(Column))[::-1]
+    ids = {it: i for i, it in enumerate(cells)}
+
+    cells_j, columns_j = [], []
+    
+    for i, it in enumerate(cells):
+        j = collections.OrderedDict()
+        j['id'] = i
+        j['kind'] = 0 if it.kind is Cell.empty else 1 if it.kind is Cell.full else -1
+        # Clockwise from the top, like angle(it, n)
+        x, y = it.x(), it.y()
+        neighbors = sorted(it.neighbors, key=lambda n: (math.atan2(n.x()-x, y-n.y())+0.01)%tau)
+        j['neighbors'] = [ids[x] for x in neighbors]
+        if it.value is not None:
+            if it.kind is Cell.empty:
+                j['members'] = j['neighbors']
+            else:
+                j['members'] = [ids[x] for x in it.members]
+        if it.revealed or (resume and getattr(it, 'revealed_resume', False)):
+            j['revealed'] = True
+        _save_common(j, it)
+        cells_j.append(j)
+    
+    for it in columns:
+        j = collections.OrderedDict()
+        if it.rotation()<-45: key = lambda it: it.x()
+        elif it.rotation()>45: key = lambda it: -it.x()
+        else: key = lambda it: it.y()
+        j['members'] = [ids[n] for n in sorted(it.members, key=key)]
+        _save_common(j, it)
+        j['angle'] = int(round(it.rotation()))
+        
+        columns_j.append(j)
+    
+    struct = collections.OrderedDict([('version', 1)])
+    if scene.title:
+        struct['title'] = scene.title
+    if scene.author:
+        struct['author'] = scene.author
+    if scene.information:
+        struct['information'] = scene.information
+    struct['cells'] = cells_j
+    struct['columns'] = columns_j
+
+    return (struct, cells, columns)
+
+def save_file(file, scene, resume=False, pretty=False, gz=False, Cell=Cell, Column=Column):
+    result, _, _ = save(scene, resume, Cell=Cell, Column=Column)
+
+    if pretty:
+        result = json.dumps(result, indent=1, separators=(',', ': '), ensure_ascii=False)
+        # Edit the resulting JSON string to join together the numbers that are alone in a line
+        lines = result.splitlines(True)
+        for i, line in enumerate(lines):
+            if line.strip().rstrip(',').isdigit():
+                lines[i-1] = lines[i-1].rstrip()+('' if '[' in lines[i-1] else ' ')
+                lines[i] = line.strip()
+                lines[i+1] = lines[i+1].lstrip()
+        result = ''.join(lines)
+    else:
+        result = json.dumps(result, separators=(',', ':'), ensure_ascii=False)
+    if isinstance(file, basestring):
+        with (gzip.open if gz else io.open)(file, 'wb') as f:
+            f.write(result.encode('utf-8'))
+    else:
+        file.write(result)
+
+
+def _load_cell(j, Cell):
+    it = Cell()
+    it.id = j['id']
+    it.kind = [Cell.empty, Cell.full, Cell.unknown][j['kind']]
+    it.revealed = j.get('revealed', False)
+    it.together = j.get('together', None)
+    it.setX(j['x'])
+    it.setY(j['y'])
+    it.value = j.get('value')
+    return it
+
+def _link_cell(it, neighbors, members, by_id):
+    try:
+        it.neighbors = [by_id[i] for i in neighbors]
+    except (TypeError, AttributeError): pass
+    try:
+        it.members = [by_id[i] for i in members or []]
+    except AttributeError: pass
+
+def _load_column(j, by_id, Column):
+    it = Column()
+    try:
+        it.members = [by_id[i] for i in j['members']]
+    except AttributeError: pass
+    it.together = j.get('together', None)
+    it.setX(j['x'])
+    it.setY(j['y'])
+    it.setRotation(j.get('angle') or 1e-3) # not zero so font doesn't look different from rotated variants
+    try:
+        it.value = j['value']
+    except AttributeError: pass
+    return it
+
+def _load_rest(cells, links, columns, info, scene, Column):
+    # `links` are the ids of neighbors and members of `cells`
+    by_id = [None]*len(cells)
+    for it in cells:
+        by_id[it.id] = it
+    for it, (neighbors, members) in zip(cells, links):
+        _link_cell(it, neighbors, members, by_id)
+    for it in by_id:
+        scene.addItem(it)
+
+    for j in columns:
+        scene.addItem(_load_column(j, by_id, Column))
+
+    scene.title = info.get('title') or ''
+    scene.author = info.get('author') or ''
+    scene.information = info.get('information') or ''
+
+    scene.full_upd()
+    return True
+
+def load(struct, scene, Cell=Cell, Column=Column):
+    cells = [_load_cell(j, Cell) for j in struct['cells']]
+    links = [(j.get('neighbors'), j.get('members')) for j in struct['cells']]
+    return _load_rest(cells, links, struct['columns'], struct, scene, Column)
+
+def read_file(file, gz=False):
+    "Parse a .sixcells/.sixcellz file; raise ValueError if it isn't valid JSON"
+    if isinstance(file, basestring):
+        file = (gzip.open if gz else io.open)(file, 'rb')
+    jj = file.read()
+    if not isinstance(jj, unicode):
+        jj = jj.decode('utf-8')
+    return json.loads(jj)
+
+
+class _JSONReader(object):
+    "Reads JSON values one by one from a file (of bytes or text), a chunk at a time"
+    whitespace = re.compile(r'[ \t\n\r]*')
+    decoder = json.JSONDecoder()
+
+    def __init__(self, file, chunk_size=0x10000):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.decode = codecs.getincrementaldecoder('utf-8')().decode
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def more(self):
+        "Read another chunk, dropping what has been read already; return False at the end of the file"
+        if self.eof:
+            return False
+        chunk = self.file.read(self.chunk_size)
+        self.eof = not chunk
+        if isinstance(chunk, bytes):
+            chunk = self.decode(chunk, self.eof)
+        self.buf = self.buf[self.pos:]+chunk
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        "Skip whitespace and return the next character"
+        while True:
+            self.pos = self.whitespace.match(self.buf, self.pos).end()
+            if self.pos<len(self.buf):
+                return self.buf[self.pos]
+            if not self.more():
+                raise ValueError("Unexpected end of JSON data")
+
+    def expect(self, chars):
+        c = self.peek()
+        if c not in chars:
+            raise ValueError("Expecting one of {} in JSON data, got {!r}".format(' '.join(chars), c))
+        self.pos += 1
+        return c
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # Maybe it's cut off at the end of the chunk
+                if self.more():
+                    continue
+                raise
+            # A number at the end of the chunk may go on in the next one
+            if end==len(self.buf) and self.more():
+                continue
+            self.pos = end
+            return value
+
+def iter_json(file, arrays=()):
+    """Iterate over the members of the JSON object in the file as (key, value), reading it gradually;
+    but the arrays under the keys in `arrays` give a pair for each of their elements instead"""
+    reader = _JSONReader(file)
+    reader.expect('{')
+    end = reader.peek()=='}'
+    while not end:
+        key = reader.value()
+        if not isinstance(key, basestring):
+            raise ValueError("Expecting a key in JSON data")
+        reader.expect(':')
+        if key in arrays and reader.peek()=='[':
+            reader.expect('[')
+            end = reader.peek()==']'
+            if end:
+                reader.expect(']')
+            while not end:
+                yield key, reader.value()
+                end = reader.expect(',]')==']'
+        else:
+            yield key, reader.value()
+        end = reader.expect(',}')=='}'
+
+def load_file(file, scene, Cell=Cell, Column=Column, gz=False):
+    """Load a .sixcells/.sixcellz file like `load`, but read it gradually, making each cell as it's read,
+    so the whole file is never in memory at once; raise ValueError if it isn't valid JSON"""
+    if isinstance(file, basestring):
+        with (gzip.open if gz else io.open)(file, 'rb') as f:
+            return load_file(f, scene, Cell=Cell, Column=Column)
+    def ids(ids):
+        # Compact until the cells are linked, so there aren't objects for every id
+        try:
+            return array.array('i', ids)
+        except TypeError:
+            return ids
+    cells, links, columns, info = [], [], [], {}
+    for key, value in iter_json(file, ('cells', 'columns')):
+        if key=='cells':
+            cells.append(_load_cell(value, Cell))
+            links.append((ids(value.get('neighbors')), ids(value.get('members'))))
+        elif key=='columns':
+            columns.append(value)
+        else:
+            info[key] = value
+    return _load_rest(cells, links, columns, info, scene, Column)
+
+# .sixcellb: the structure of a .sixcells level in little-endian arrays,
+# which are used in place (memory-mapped) when loading a file.
+# The header is followed by the title, author and information (UTF-8)
+# and by the sections of _binary_sections, each padded to a multiple of 8 bytes.
+# Positions are pairs of hexcells_pos if every item is exactly there, otherwise floats;
+# ids of cells are 16-bit if there are few enough cells, otherwise 32-bit.
+# Flags of an item: the kind of a cell in the lowest 2 bits (empty, full, unknown), then
+_revealed, _has_value, _has_together, _together, _has_members, _same_members = 4, 8, 16, 32, 64, 128
+_binary_header = Struct('<4sHHIIIIIIII')
+# magic, version, layout flags, cells, columns, neighbors, members, column members,
+# lengths of the title, author, information
+_float_pos, _wide_ids = 1, 2
+_binary_magic = b'SXCB'
+_u32 = 'I' if array.array('I').itemsize==4 else 'L'
+_binary_views = hasattr(memoryview, 'cast') and sys.byteorder=='little'
+
+def _binary_sections(cells, columns, neighbors, members, column_members, layout):
+    pos = 'd' if layout&_float_pos else 'h'
+    ids = _u32 if layout&_wide_ids else 'H'
+    return [
+        ('cell_flags', 'B', cells), ('cell_values', 'H', cells), ('cell_pos', pos, cells*2),
+        ('neighbor_offsets', _u32, cells+1), ('neighbors', ids, neighbors),
+        ('member_offsets', _u32, cells+1), ('members', ids, members),
+        ('column_flags', 'B', columns), ('column_values', 'H', columns),
+        ('column_angles', 'h', columns), ('column_pos', pos, columns*2),
+        ('column_member_offsets', _u32, columns+1), ('column_members', ids, column_members),
+    ]
+
+def _padding(size):
+    return b'\0'*(-size%8)
+
+def struct_to_binary(struct):
+    "The .sixcellb form of a level's structure (as made by `save`), as bytes"
+    cells, columns = struct['cells'], struct['columns']
+    grid_pos = [hexcells_pos(j['x'], j['y']) for j in itertools.chain(cells, columns)]
+    float_pos = any(
+        x*cos30!=j['x'] or y/2!=j['y'] or not (-0x8000<=x<0x8000 and -0x8000<=y<0x8000)
+        for (x, y), j in zip(grid_pos, itertools.chain(cells, columns))
+    )
+    layout = (_float_pos if float_pos else 0) | (_wide_ids if len(cells)>0x10000 else 0)
+    sections = _binary_sections(0, 0, 0, 0, 0, layout)
+    a = {name: array.array(typecode) for name, typecode, count in sections}
+    for name, items, items_pos in [('cell_pos', cells, grid_pos[:len(cells)]), ('column_pos', columns, grid_pos[len(cells):])]:
+        for j, xy in zip(items, items_pos):
+            a[name].extend([j['x'], j['y']] if float_pos else xy)
+
+    def common(j):
+        flags = 0
+        if 'value' in j:
+            flags |= _has_value
+        if 'together' in j:
+            flags |= _has_together | (_together if j['together'] else 0)
+        return flags
+
+    a['neighbor_offsets'].append(0)
+    a['member_offsets'].append(0)
+    for i, j in enumerate(cells):
+        if j['id']!=i:
+            raise ValueError("The cells must be in the order of their ids")
+        flags = common(j) | j['kind']%3
+        if j.get('revealed'):
+            flags |= _revealed
+        a['neighbors'].extend(j['neighbors'])
+        if 'members' in j:
+            flags |= _has_members
+            if j['members']==j['neighbors']:
+                flags |= _same_members
+            else:
+                a['members'].extend(j['members'])
+        a['cell_flags'].append(flags)
+        a['cell_values'].append(j.get('value', 0))
+        a['neighbor_offsets'].append(len(a['neighbors']))
+        a['member_offsets'].append(len(a['members']))
+
+    a['column_member_offsets'].append(0)
+    for j in columns:
+        a['column_flags'].append(common(j))
+        a['column_values'].append(j.get('value', 0))
+        a['column_angles'].append(j['angle'])
+        a['column_members'].extend(j['members'])
+        a['column_member_offsets'].append(len(a['column_members']))
+
+    texts = [struct.get(key, '').encode('utf-8') for key in ['title', 'author', 'information']]
+    header = _binary_header.pack(
+        _binary_magic, 1, layout, len(cells), len(columns),
+        len(a['neighbors']), len(a['members']), len(a['column_members']), *[len(t) for t in texts]
+    )
+    result = [header]+texts
+    result.append(_padding(sum(len(part) for part in result)))
+    for name, typecode, count in sections:
+        if sys.byteorder!='little':
+            a[name].byteswap()
+        data = a[name].tobytes() if hasattr(a[name], 'tobytes') else a[name].tostring()
+        result += [data, _padding(len(data))]
+    return b''.join(result)
+
+def _array_at(buf, offset, typecode, count):
+    "The array of `count` items at `offset` in `buf` (not a copy, where possible); and the offset after it"
+    end = offset+array.array(typecode).itemsize*count
+    if end>len(buf):
+        raise ValueError("The level file is cut off")
+    if _binary_views:
+        result = memoryview(buf)[offset:end].cast(typecode)
+    else:
+        result = array.array(typecode)
+        (result.frombytes if hasattr(result, 'frombytes') else result.fromstring)(bytes(buf[offset:end]))
+        if sys.byteorder!='little':
+            result.byteswap()
+    return result, end-end%-8
+
+def read_binary(buf):
+    """Read a level's .sixcellb form, from bytes or a memory map, without copying the data.
+    Return (title, author, information, arrays by the names of _binary_sections, function giving an item's position)
+    Raise ValueError if it isn't a valid .sixcellb level"""
+    if len(buf)<_binary_header.size or bytes(buf[:4])!=_binary_magic:
+        raise ValueError("This is not a SixCells binary level")
+    header = _binary_header.unpack_from(buf, 0)
+    if header[1]!=1:
+        raise ValueError("Can read only SixCells binary level version 1")
+    layout = header[2]
+    offset = _binary_header.size
+    texts = []
+    for length in header[8:]:
+        texts.append(bytes(buf[offset:offset+length]).decode('utf-8'))
+        offset += length
+    offset -= offset%-8
+    arrays = {}
+    for name, typecode, count in _binary_sections(*header[3:8]+(layout,)):
+        arrays[name], offset = _array_at(buf, offset, typecode, count)
+    if layout&_float_pos:
+        def position(pos, i):
+            return pos[i*2], pos[i*2+1]
+    else:
+        def position(pos, i):
+            return pos[i*2]*cos30, pos[i*2+1]/2
+    title, author, information = texts
+    return title, author, information, arrays, position
+
+def binary_to_struct(buf):
+    "The structure of a level (as made by `save`) from its .sixcellb form"
+    title, author, information, a, position = read_binary(buf)
+    flags, values = a['cell_flags'], a['cell_values']
+    neighbors, neighbor_offsets = a['neighbors'], a['neighbor_offsets']
+    members, member_offsets = a['members'], a['member_offsets']
+
+    def common(j, flags, value, pos, i):
+        if flags&_has_value:
+            j['value'] = value
+        if flags&_has_together:
+            j['together'] = bool(flags&_together)
+        j['x'], j['y'] = position(pos, i)
+
+    cells_j = []
+    for i in range(len(flags)):
+        j = collections.OrderedDict()
+        j['id'] = i
+        j['kind'] = [0, 1, -1][flags[i]&3]
+        j['neighbors'] = neighbors[neighbor_offsets[i]:neighbor_offsets[i+1]].tolist()
+        if flags[i]&_has_members:
+            j['members'] = j['neighbors'] if flags[i]&_same_members else members[member_offsets[i]:member_offsets[i+1]].tolist()
+        if flags[i]&_revealed:
+            j['revealed'] = True
+        common(j, flags[i], values[i], a['cell_pos'], i)
+        cells_j.append(j)
+
+    columns_j = []
+    members, member_offsets = a['column_members'], a['column_member_offsets']
+    for i, flags in enumerate(a['column_flags']):
+        j = collections.OrderedDict()
+        j['members'] = members[member_offsets[i]:member_offsets[i+1]].tolist()
+        common(j, flags, a['column_values'][i], a['column_pos'], i)
+        j['angle'] = a['column_angles'][i]
+        columns_j.append(j)
+
+    struct = collections.OrderedDict([('version', 1)])
+    if title:
+        struct['title'] = title
+    if author:
+        struct['author'] = author
+    if information:
+        struct['information'] = information
+    struct['cells'] = cells_j
+    struct['columns'] = columns_j
+    _release(a)
+    return struct
+
+def save_binary(file, scene, Cell=Cell, Column=Column):
+    result = struct_to_binary(save(scene, Cell=Cell, Column=Column)[0])
+    if isinstance(file, basestring):
+        with io.open(file, 'wb') as f:
+            f.write(result)
+    else:
+        file.write(result)
+
+def map_file(fn):
+    "The contents of the file, memory-mapped"
+    with io.open(fn, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def load_binary(file, scene, Cell=Cell, Column=Column):
+    "Like load_file, for a .sixcellb file; the items are made straight from its arrays"
+    if not isinstance(file, basestring):
+        return _load_binary(file.read(), scene, Cell, Column)
+    buf = map_file(file)
+    try:
+        return _load_binary(buf, scene, Cell, Column)
+    finally:
+        buf.close()
+
+def _release(arrays):
+    "Let go of the arrays made by read_binary, so the memory map they are in can be closed"
+    for values in arrays.values():
+        if isinstance(values, memoryview):
+            values.release()
+
+def _load_binary(buf, scene, Cell, Column):
+    title, author, information, a, position = read_binary(buf)
+    try:
+        _make_items(a, position, scene, Cell, Column)
+    finally:
+        _release(a)
+    scene.title = title
+    scene.author = author
+    scene.information = information
+
+    scene.full_upd()
+    return True
+
+def _make_items(a, position, scene, Cell, Column):
+    kinds = [Cell.empty, Cell.full, Cell.unknown]
+    flags, values, pos = a['cell_flags'], a['cell_values'], a['cell_pos']
+    by_id = [None]*len(flags)
+    for i, f in enumerate(flags):
+        it = Cell()
+        it.id = i
+        by_id[i] = it
+        it.kind = kinds[f&3]
+        it.revealed = bool(f&_revealed)
+        it.together = bool(f&_together) if f&_has_together else None
+        x, y = position(pos, i)
+        it.setX(x)
+        it.setY(y)
+        it.value = values[i] if f&_has_value else None
+    neighbors, neighbor_offsets = a['neighbors'], a['neighbor_offsets']
+    members, member_offsets = a['members'], a['member_offsets']
+    for i, it in enumerate(by_id):
+        f = flags[i]
+        try:
+            it.neighbors = [by_id[k] for k in neighbors[neighbor_offsets[i]:neighbor_offsets[i+1]]]
+        except AttributeError: pass
+        if f&_same_members:
+            ids = neighbors[neighbor_offsets[i]:neighbor_offsets[i+1]]
+        else:
+            ids = members[member_offsets[i]:member_offsets[i+1]]
+        try:
+            it.members = [by_id[k] for k in ids]
+        except AttributeError: pass
+    for it in by_id:
+        scene.addItem(it)
+
+    flags, values, pos = a['column_flags'], a['column_values'], a['column_pos']
+    members, member_offsets = a['column_members'], a['column_member_offsets']
+    for i, f in enumerate(flags):
+        it = Column()
+        try:
+            it.members = [by_id[k] for k in members[member_offsets[i]:member_offsets[i+1]]]
+        except AttributeError: pass
+        it.together = bool(f&_together) if f&_has_together else None
+        x, y = position(pos, i)
+        it.setX(x)
+        it.setY(y)
+        it.setRotation(a['column_angles'][i] or 1e-3) # not zero so font doesn't look different from rotated variants
+        try:
+            it.value = values[i] if f&_has_value else None
+        except AttributeError: pass
+        scene.addItem(it)
+
+
+# The grid of a .hexcells level is kept as a bytearray of its 33 lines of 33 items,
+# 2 characters each (kind and info), without line breaks; '..' is nothing.
+hexcells_size = 33
+hexcells_empty_grid = b'.'*(hexcells_size*hexcells_size*2)
+_hexcells_kinds = re.compile(r'[oxOX\\|/]')
+
+def parse_hexcells(text):
+    """Parse the text of a .hexcells level into (title, author, information, grid).
+    Raise ValueError if it isn't a Hexcells level v1"""
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    lines = text.split('\n')
+    lines[len(lines):5] = ['']*(5-len(lines))
+    if lines[0].strip()!='Hexcells level v1':
+        raise ValueError("Can read only Hexcells level v1")
+    title = lines[1].strip()
+    author = lines[2].strip()
+    information = '\n'.join(line for line in [lines[3].strip(), lines[4].strip()] if line)
+
+    width = hexcells_size*2
+    grid = bytearray(hexcells_empty_grid)
+    for y, line in enumerate(lines[5:]):
+        line = line.strip().replace(' ', '').encode('ascii', 'replace')
+        line = line[:len(line)//2*2]
+        if len(line)>width or (y>=hexcells_size and line.strip(b'.')):
+            raise ValueError("This level is bigger than the Hexcells format allows")
+        grid[y*width:y*width+len(line)] = line
+    return title, author, information, grid
+
+def format_hexcells(title, author, information, grid):
+    "The text of a .hexcells level as bytes; the reverse of parse_hexcells"
+    width = hexcells_size*2
+    lines = [
+        b'Hexcells level v1', title.encode('utf-8'), author.encode('utf-8'),
+        (b'\n' if '\n' not in information else b'')+information.encode('utf-8')
+    ]
+    lines.extend(bytes(grid[i:i+width]) for i in range(0, len(grid), width))
+    return b'\n'.join(lines)
+
+def hexcells_items(grid):
+    "Iterate over the items in a grid from parse_hexcells as (x, y, kind, info)"
+    kinds = grid[0::2].decode('ascii')
+    infos = grid[1::2].decode('ascii')
+    for m in _hexcells_kinds.finditer(kinds):
+        i = m.start()
+        y, x = divmod(i, hexcells_size)
+        yield x, y, kinds[i], infos[i]
+
+
+# .sixcellp: a pack of levels in .sixcellb form, after a header and an index in JSON
+# with the title, author, number of cells and columns, offset (from the end of the index, padded)
+# and size of each level; every level is padded to a multiple of 8 bytes
+_pack_header = Struct('<4sHHI')
+# magic, version, unused, size of the index
+_pack_magic = b'SXCP'
+
+def save_pack(file, levels):
+    "Save a level pack of the levels, given in .sixcellb form"
+    levels = list(levels)
+    index = []
+    offset = 0
+    for data in levels:
+        title, author, information, a, _ = read_binary(data)
+        index.append(collections.OrderedDict([
+            ('title', title), ('author', author),
+            ('cells', len(a['cell_flags'])), ('columns', len(a['column_flags'])),
+            ('offset', offset), ('size', len(data)),
+        ]))
+        offset += len(data)+len(_padding(len(data)))
+    index = json.dumps(index, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+    result = [_pack_header.pack(_pack_magic, 1, 0, len(index)), index]
+    result.append(_padding(sum(len(part) for part in result)))
+    for data in levels:
+        result += [data, _padding(len(data))]
+
+    result = b''.join(result)
+    if isinstance(file, basestring):
+        with io.open(file, 'wb') as f:
+            f.write(result)
+    else:
+        file.write(result)
+
+class Pack(object):
+    """Levels in a .sixcellp file.
+    Only the index is read when it's opened; a level is read when it's loaded."""
+    def __init__(self, fn):
+        self.buffer = map_file(fn)
+        if len(self.buffer)<_pack_header.size or self.buffer[:4]!=_pack_magic:
+            raise ValueError("This is not a SixCells level pack")
+        magic, version, _, size = _pack_header.unpack_from(self.buffer, 0)
+        if version!=1:
+            raise ValueError("Can read only SixCells level pack version 1")
+        end = _pack_header.size+size
+        self.levels = json.loads(self.buffer[_pack_header.size:end].decode('utf-8'))
+        self._start = end-end%-8
+
+    def __len__(self):
+        return len(self.levels)
+
+    def data(self, i):
+        "The .sixcellb form of the level number `i`"
+        start = self._start+self.levels[i]['offset']
+        end = start+self.levels[i]['size']
+        if end>len(self.buffer):
+            raise ValueError("The level file is cut off")
+        return memoryview(self.buffer)[start:end] if _binary_views else self.buffer[start:end]
+
+    def load(self, i, scene, Cell=Cell, Column=Column):
+        "Like load_binary, for the level number `i`"
+        return _load_binary(self.data(i), scene, Cell, Column)
+
+
+hexcells_ui_area = [
+    '     *************************   ',
+    '     *#######################*   ',
+    '    *########################*   ',
+    '    *########################*   ',
+    '   *#########################*   ',
+    '   ##########################*   ',
+    '  *##########################****',
+    ' *###############################',
+    ' *###############################',
+    '*################################',
+    '*################################'
+]+[
+    '#'*33
+]*22
+
+def save_hexcells(file, scene, Cell=Cell, Column=Column):
+    grid = {}
+    for it in scene.all():
+        if isinstance(it, (Cell, Column)):
+            grid[hexcells_pos(it.x(), it.y())] = it
+    min_x, max_x = minmax([x for x, y in grid] or [0])
+    min_y, max_y = minmax([y for x, y in grid] or [0])
+    mid_x, mid_y = (min_x+max_x)//2, (min_y+max_y)//2
+    max_t = 32
+    mid_t = (0+max_t)//2
+
+    if max_x-min_x>max_t:
+        raise ValueError("This level is too wide to fit into Hexcells format")
+    if max_y-min_y>max_t:
+        raise ValueError("This level is too high to fit into Hexcells format")
+
+    mid_d = mid_t-mid_x, mid_t-mid_y
+
+    ui_area = list(hexcells_ui_area)
+    d = len(scene.information.splitlines())*2-2
+    if d>0:
+        ui_area[-d:] = [' '*33]*d
+
+    # Look for the offset where the level overlaps the UI the least,
+    # then is closest to the middle (on average and by its bounds), then is the topmost, leftmost.
+    # Overlaps are weighted in thousandths, by the kind of item and of UI area;
+    # the UI area is a few runs of characters in each line, and the number of items
+    # that a run covers is found from running sums of the items in each line of the level.
+    weights = {Cell: {'*': 900, ' ': 1000}, Column: {'*': 1, ' ': 850}}
+    runs = [[] for line in ui_area]
+    for u, line in enumerate(ui_area):
+        a = 0
+        for c, chars in itertools.groupby(line):
+            b = a+len(list(chars))
+            if c!='#':
+                runs[u].append((a, b, weights[Cell][c], weights[Column][c]))
+            a = b
+    width = max_x-min_x+1
+    sums = [([0]*(width+1), [0]*(width+1)) for y in range(min_y, max_y+1)]
+    for (x, y), it in grid.items():
+        sums[y-min_y][0 if isinstance(it, Cell) else 1][x-min_x+1] += 1
+    for line in sums:
+        for counts in line:
+            for i in range(width):
+                counts[i+1] += counts[i]
+
+    # The average squared distance from the middle is found in closed form:
+    # sum(|p+d-m|^2) = sum(|p-m|^2) + 2*d.sum(p-m) + n*|d|^2
+    # and multiplied by n, like the rest of the distance, to stay an integer.
+    n = len(grid)
+    sq = sum((x-mid_t)**2+(y-mid_t)**2 for x, y in grid)
+    sx = sum(x-mid_t for x, y in grid)
+    sy = sum(y-mid_t for x, y in grid)
+
+    best = None
+    dxs = range(-min_x, -min_x+max_t-(max_x-min_x)+1)
+    for dy in range(-min_y, -min_y+max_t-(max_y-min_y)+1):
+        overlaps_by_dx = [0]*len(dxs)
+        # The runs that the level's lines are in, with those lines' sums
+        for y in range(min_y, max_y+1):
+            cells, columns = sums[y-min_y]
+            for a, b, cell_weight, column_weight in runs[y+dy]:
+                # The offsets that make the run cover part of the line
+                a, b = a-min_x, b-min_x
+                for i in range(max(0, a-width+1-dxs[0]), min(len(dxs), b-dxs[0])):
+                    dx = dxs[i]
+                    lo, hi = max(a-dx, 0), min(b-dx, width)
+                    overlaps_by_dx[i] += cell_weight*(cells[hi]-cells[lo])+column_weight*(columns[hi]-columns[lo])
+        for dx, overlaps in zip(dxs, overlaps_by_dx):
+            dist = (
+                sq+2*(dx*sx+dy*sy)+n*(dx*dx+dy*dy)+
+                (n or 1)*((dx-mid_d[0])**2+(dy-mid_d[1])**2)
+            )
+            if best is None or (overlaps, dist, (dy, dx))<best:
+                best = (overlaps, dist, (dy, dx))
+    overlaps, _, (dy, dx) = best
+    overlaps /= 1000
+    if overlaps>0.8:
+        ret = "This level (barely) fits, but may overlap some UI elements of Hexcells."
+    else:
+        ret = True
+        
+    result = bytearray(hexcells_empty_grid)
+    for (x, y), it in grid.items():
+        if isinstance(it, Column):
+            kind = {-90: '>', -60: '\\', 0: '|', 60: '/', 90: '<'}[int(round(it.rotation()))]
+        else:
+            kind = 'x' if it.kind is Cell.full else 'o'
+            if it.revealed:
+                kind = kind.upper()
+        if it.value is not None:
+            if it.together is not None:
+                info = 'c' if it.together else 'n'
+            else:
+                info = '+'
+        else:
+            info = '.'
+        i = ((y+dy)*hexcells_size+x+dx)*2
+        result[i:i+2] = (kind+info).encode('ascii')
+    if isinstance(file, basestring):
+        file = io.open(file, 'wb')
+    file.write(format_hexcells(scene.title, scene.author, scene.information, result))
+    
+    return ret
+
+
+def load_hexcells(file, scene, Cell=Cell, Column=Column):
+    if isinstance(file, basestring):
+        with io.open(file, encoding='utf-8') as f:
+            text = f.read()
+    else:
+        text = file.read()
+    scene.title, scene.author, scene.information, grid = parse_hexcells(text)
+
+    for x, y, kind, info in hexcells_items(grid):
+        item = Cell() if kind in 'oxOX' else Column()
+        item.setX(x*cos30)
+        item.setY(y/2)
+
+        if isinstance(item, Cell):
+            item.kind = Cell.full if kind in 'xX' else Cell.empty
+            item.revealed = kind.isupper()
+            item.show_info = 0 if info=='.' else 1 if info=='+' else 2
+        else:
+            item.setRotation(-60 if kind=='\\' else 60 if kind=='/' else 1e-3)
+            item.show_info = False if info=='+' else True
+
+        scene.addItem(item)
+
+    scene.full_upd()
+
+
+extensions = ('.hexcells', '.sixcells', '.sixcellz', '.sixcellb')
+
+def find_levels(paths):
+    """Iterate over the level files in `paths`, which are files, directories or glob patterns,
+    as (directory that was given or the file's directory, file)"""
+    for path in paths:
+        if not os.path.exists(path) and glob.has_magic(path):
+            for result in find_levels(sorted(glob.glob(path))):
+                yield result
+        elif os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for fn in sorted(files):
+                    if fn.endswith(extensions):
+                        yield path, os.path.join(root, fn)
+        else:
+            yield os.path.dirname(path), path
+
+def open_level(fn):
+    "Load a level file of any supported format into a new Level"
+    level = Level()
+    if fn.endswith('.hexcells'):
+        load_hexcells(fn, level)
+    elif fn.endswith('.sixcellb'):
+        load_binary(fn, level)
+    else:
+        load_file(fn, level, gz=fn.endswith('.sixcellz'))
+    return level
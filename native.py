@@ -0,0 +1,418 @@
+# Copyright (C) 2014 Stefan Walzer <sekti@gmx.net>
+#
+# This file is part of SixCells.
+#
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""An in-process constraint propagation solver for the problems built by solver.solve"""
+# Hexcells constraints are small sums over small integer variables,
+# so bounds propagation plus backtracking finds solutions quickly,
+# without spawning an external MILP solver.
+
+from __future__ import division, print_function
+
+import collections
+import itertools
+
+
+class Problem(object):
+    """Integer variables with bounds and linear constraints of the form
+    lo <= sum(coef*var) <= hi, where either bound may be None."""
+    # Constraints with more variables than this are not followed by `order`:
+    # as many as a cell's number can be about (its flower). Longer ones, like columns,
+    # lead the search in a line across the level, away from where conflicts are.
+    local_size = 18
+    # If set, called every `check_interval` decisions of a search;
+    # it can raise an exception to interrupt the search
+    check = None
+    check_interval = 256
+
+    def __init__(self):
+        self.lo = []
+        self.hi = []
+        self.constraints = []
+        # watch[var] lists the indexes of constraints that var appears in
+        self.watch = []
+        # coefs[var] lists (constraint index, coef) for the same constraints
+        self.coefs = []
+        # Cached by `order` and `solve`
+        self._adjacent = None
+        self._hinted = None
+        # Number of calls of `solve`
+        self.searches = 0
+
+    def add_var(self, lo, hi):
+        self.lo.append(lo)
+        self.hi.append(hi)
+        self.watch.append([])
+        self.coefs.append([])
+        return len(self.lo)-1
+
+    def add(self, terms, lo=None, hi=None):
+        "`terms` is a list of (var, coef) pairs"
+        terms = [(v, a) for v, a in terms if a]
+        index = len(self.constraints)
+        self.constraints.append((terms, lo, hi))
+        for v, a in terms:
+            self.watch[v].append(index)
+            self.coefs[v].append((index, a))
+        self._adjacent = None
+        self._hinted = None
+
+    def propagate(self, lo, hi, queue=None):
+        """Tighten the bounds `lo`, `hi` (lists, modified in place)
+        until no constraint allows further tightening.
+        Only the constraints in `queue` (default: all) are looked at initially.
+        Return False if a constraint can't be satisfied."""
+        return self._propagate(lo, hi, queue) is None
+
+    def _propagate(self, lo, hi, queue=None, lo_why=None, hi_why=None, trail=None):
+        """`propagate`, optionally keeping track of the reasons for the bounds:
+        lo_why[v] and hi_why[v] are bitmasks of the search decisions a bound follows from.
+        Every change is recorded in `trail` as (var, lo, hi, lo_why, hi_why) from before it.
+        Return None, or the bitmask of the decisions that together can't be satisfied."""
+        constraints = self.constraints
+        watch = self.watch
+        why = lo_why is not None
+        up_why = down_why = 0
+        if queue is None:
+            queue = range(len(constraints))
+        pending = list(queue)
+        queued = set(pending)
+        while pending:
+            c = pending.pop()
+            queued.discard(c)
+            terms, clo, chi = constraints[c]
+
+            minact = maxact = span = 0
+            for v, a in terms:
+                if a>0:
+                    minact += a*lo[v]
+                    maxact += a*hi[v]
+                    d = a*(hi[v]-lo[v])
+                else:
+                    minact += a*hi[v]
+                    maxact += a*lo[v]
+                    d = -a*(hi[v]-lo[v])
+                if d>span:
+                    span = d
+            # Slack of the constraint on each side; no variable can be tightened
+            # unless its range is wider than the slack
+            up = None if chi is None else chi-minact
+            down = None if clo is None else maxact-clo
+            if (up is None or up>=span) and (down is None or down>=span):
+                continue
+            if why:
+                # The bounds that minact and maxact are made of
+                up_why = down_why = 0
+                for v, a in terms:
+                    if a>0:
+                        up_why |= lo_why[v]
+                        down_why |= hi_why[v]
+                    else:
+                        up_why |= hi_why[v]
+                        down_why |= lo_why[v]
+            if up is not None and up<0:
+                return up_why
+            if down is not None and down<0:
+                return down_why
+
+            changed = False
+            for v, a in terms:
+                old_lo, old_hi = lo[v], hi[v]
+                new_lo, new_hi = old_lo, old_hi
+                if a>0:
+                    if up is not None and old_lo+up//a<new_hi:
+                        new_hi = old_lo+up//a
+                    if down is not None and old_hi-down//a>new_lo:
+                        new_lo = old_hi-down//a
+                    lo_reason, hi_reason = down_why, up_why
+                else:
+                    if up is not None and old_hi-up//-a>new_lo:
+                        new_lo = old_hi-up//-a
+                    if down is not None and old_lo+down//-a<new_hi:
+                        new_hi = old_lo+down//-a
+                    lo_reason, hi_reason = up_why, down_why
+                if new_lo==old_lo and new_hi==old_hi:
+                    continue
+                if why:
+                    trail.append((v, old_lo, old_hi, lo_why[v], hi_why[v]))
+                    if new_lo!=old_lo:
+                        lo_why[v] = lo_reason
+                    if new_hi!=old_hi:
+                        hi_why[v] = hi_reason
+                if new_lo>new_hi:
+                    return lo_why[v]|hi_why[v] if why else 0
+                lo[v], hi[v] = new_lo, new_hi
+                changed = True
+                for d in watch[v]:
+                    if d not in queued:
+                        queued.add(d)
+                        pending.append(d)
+            # The activities used above were computed before tightening,
+            # so look at this constraint again
+            if changed and c not in queued:
+                queued.add(c)
+                pending.append(c)
+        return None
+
+    def order(self, first=None):
+        """The order in which to branch on the variables:
+        starting with `first` (default: the most constrained one),
+        then ones that share constraints with it, and so on.
+        Keeping the search within a neighborhood makes conflicts show up early."""
+        return list(self._order(first))
+
+    def _order(self, first=None):
+        # `order`, one variable at a time, so that a search that ends early doesn't pay for all of it
+        if self._adjacent is None or len(self._adjacent)!=len(self.lo):
+            self._adjacent = []
+            for v in range(len(self.lo)):
+                adjacent = set()
+                for c in self.watch[v]:
+                    terms = self.constraints[c][0]
+                    # Sums over large parts of the level (like the remaining count) connect everything
+                    if len(terms)<=self.local_size:
+                        adjacent.update(u for u, _ in terms)
+                adjacent.discard(v)
+                self._adjacent.append(sorted(adjacent))
+            self._starts = sorted(range(len(self.lo)), key=lambda v: -len(self.watch[v]))
+        adjacent = self._adjacent
+        seen = set()
+        starts = self._starts if first is None else itertools.chain([first], self._starts)
+        for start in starts:
+            if start in seen:
+                continue
+            seen.add(start)
+            queue = collections.deque([start])
+            while queue:
+                v = queue.popleft()
+                yield v
+                for u in adjacent[v]:
+                    if u not in seen:
+                        seen.add(u)
+                        queue.append(u)
+
+    def _hint_activity(self, hint):
+        # The activity of every constraint for the values in `hint`, kept for the next search
+        if self._hinted is None or self._hinted[0]!=hint:
+            self._hinted = list(hint), [sum(a*hint[v] for v, a in terms) for terms, _, _ in self.constraints]
+        return self._hinted[1]
+
+    def solve(self, lo=None, hi=None, queue=None, first=None, hint=None):
+        """Find a value for every variable, within the bounds `lo`, `hi`
+        (default: the bounds the variables were created with).
+        If the bounds are known to be propagated except for the constraints in `queue`,
+        passing it saves the work of looking at all the constraints again.
+        The search starts around the variable `first`, if given,
+        and tries the values from `hint` (e.g. a previous solution) before others.
+        Return the list of values or None if there is no solution."""
+        self.searches += 1
+        lo = list(self.lo if lo is None else lo)
+        hi = list(self.hi if hi is None else hi)
+        if any(l>h for l, h in zip(lo, hi)) or not self.propagate(lo, hi, queue):
+            return None
+        constraints = self.constraints
+        watch = self.watch
+        coefs = self.coefs
+
+        # With a hint, the search is over as soon as the hint, moved into the bounds,
+        # satisfies every constraint. When the hint is a solution of a similar problem
+        # (see `backbone`), that happens once the variables around `first` are decided,
+        # instead of all of them. To see it, the activity of every constraint
+        # for those values, and the constraints that it violates, are kept up to date.
+        if hint is not None:
+            values = list(hint)
+            activity = list(self._hint_activity(hint))
+            undone = [v for v in range(len(lo)) if not lo[v]<=hint[v]<=hi[v]]
+            violated = set()
+            for c, (terms, clo, chi) in enumerate(constraints):
+                if (clo is not None and activity[c]<clo) or (chi is not None and activity[c]>chi):
+                    violated.add(c)
+            # Trail entries that are taken into account, and (in `undone`) variables
+            # whose bounds changed otherwise since then
+            synced = 0
+
+        # Depth-first search with backjumping: every bound remembers the decisions
+        # it follows from, so after a conflict the search goes straight back
+        # to the latest decision that took part in it, instead of trying
+        # every combination of the unrelated decisions made in between.
+        lo_why = [0]*len(lo)
+        hi_why = [0]*len(hi)
+        trail = []
+        # For each decision (level 1, 2, ...): (trail length, position in order, var, bound)
+        decisions = []
+        # The variables in the order they are branched on, as far as the search got
+        order = []
+        rest = self._order(first)
+        i = 0
+        steps = 0
+        while True:
+            steps += 1
+            if self.check is not None and steps%self.check_interval==0:
+                self.check()
+            if hint is not None:
+                for u in itertools.chain(undone, [entry[0] for entry in trail[synced:]]):
+                    new = min(max(hint[u], lo[u]), hi[u])
+                    if new==values[u]:
+                        continue
+                    for c, a in coefs[u]:
+                        activity[c] += a*(new-values[u])
+                        _, clo, chi = constraints[c]
+                        if (clo is not None and activity[c]<clo) or (chi is not None and activity[c]>chi):
+                            violated.add(c)
+                        else:
+                            violated.discard(c)
+                    values[u] = new
+                del undone[:]
+                synced = len(trail)
+                if not violated:
+                    # The activities are right for the next search with this as its hint
+                    self._hinted = list(values), activity
+                    return values
+            while True:
+                if i==len(order):
+                    v = next(rest, None)
+                    if v is None:
+                        return lo
+                    order.append(v)
+                if lo[order[i]]!=hi[order[i]]:
+                    break
+                i += 1
+            v = order[i]
+            # Try the hinted (or the lowest) value first
+            value = lo[v] if hint is None else min(max(hint[v], lo[v]), hi[v])
+            decisions.append((len(trail), i, v, value))
+            level = 1<<len(decisions)
+            trail.append((v, lo[v], hi[v], lo_why[v], hi_why[v]))
+            if value<hi[v]:
+                hi[v], hi_why[v] = value, level
+            else:
+                lo[v], lo_why[v] = value, level
+            conflict = self._propagate(lo, hi, watch[v], lo_why, hi_why, trail)
+
+            while conflict is not None:
+                if not conflict:
+                    return None
+                # Undo everything since the latest decision involved
+                level = conflict.bit_length()-1
+                start, i, v, value = decisions[level-1]
+                del decisions[level-1:]
+                while len(trail)>start:
+                    u, lo[u], hi[u], lo_why[u], hi_why[u] = trail.pop()
+                    if hint is not None:
+                        undone.append(u)
+                if hint is not None:
+                    synced = min(synced, len(trail))
+                # The other decisions involved rule out that one
+                reason = conflict & ~(1<<level)
+                trail.append((v, lo[v], hi[v], lo_why[v], hi_why[v]))
+                if value<hi[v]:
+                    lo[v], lo_why[v] = value+1, reason
+                else:
+                    hi[v], hi_why[v] = value-1, reason
+                if lo[v]>hi[v]:
+                    conflict = lo_why[v]|hi_why[v]
+                else:
+                    conflict = self._propagate(lo, hi, watch[v], lo_why, hi_why, trail)
+
+    def solutions(self, lo=None, hi=None):
+        """Yield every solution within the bounds `lo`, `hi`
+        (default: the bounds the variables were created with), each one once.
+        Solutions are looked for as they are asked for, so stopping early saves the work."""
+        lo = list(self.lo if lo is None else lo)
+        hi = list(self.hi if hi is None else hi)
+        if any(l>h for l, h in zip(lo, hi)) or not self.propagate(lo, hi):
+            return
+        solution = self.solve(lo, hi, ())
+        if solution is None:
+            return
+        yield solution
+        order = self.order()
+        watch = self.watch
+
+        # Every other solution first differs from a found one at some position in `order`.
+        # An entry (lo, hi, solution, i) stands for the solutions within lo, hi,
+        # that agree with `solution` on the variables before position i, except itself.
+        # Those are split by the first variable they differ at, so no part is searched twice.
+        stack = [(lo, hi, solution, 0)]
+        while stack:
+            lo, hi, solution, i = stack.pop()
+            while i<len(order):
+                v = order[i]
+                i += 1
+                if lo[v]==hi[v]:
+                    continue
+                if self.check is not None:
+                    self.check()
+                value = solution[v]
+                found = []
+                for bounds in [(lo[v], value-1), (value+1, hi[v])]:
+                    if bounds[0]>bounds[1]:
+                        continue
+                    other_lo, other_hi = list(lo), list(hi)
+                    other_lo[v], other_hi[v] = bounds
+                    if self.propagate(other_lo, other_hi, watch[v]):
+                        other = self.solve(other_lo, other_hi, (), first=v, hint=solution)
+                        if other is not None:
+                            found.append((other_lo, other_hi, other, 0))
+                # The rest agree with this solution on v too
+                lo[v] = hi[v] = value
+                self.propagate(lo, hi, watch[v])
+                if found:
+                    stack.append((lo, hi, solution, i))
+                    for entry in found:
+                        yield entry[2]
+                        stack.append(entry)
+                    break
+
+    def backbone(self, candidates=None):
+        """Find the variables that have the same value in all solutions,
+        as long as that value is one of their bounds.
+        Only the variables in `candidates` (default: all) are considered.
+        Return a dict {var: value}, empty if there is no solution at all."""
+        lo, hi = list(self.lo), list(self.hi)
+        if not self.propagate(lo, hi):
+            return {}
+        solution = self.solve(lo, hi, ())
+        if solution is None:
+            return {}
+        if candidates is None:
+            candidates = range(len(lo))
+        # Candidates that are at one of their bounds in every solution found so far
+        pure = {v: solution[v] for v in candidates if solution[v] in (lo[v], hi[v])}
+        result = {}
+        for v in list(pure):
+            if v not in pure:
+                continue
+            value = pure.pop(v)
+            # Look for a solution where the variable differs
+            other_lo, other_hi = list(lo), list(hi)
+            if value==lo[v]:
+                other_lo[v] = value+1
+            else:
+                other_hi[v] = value-1
+            found = self.solve(other_lo, other_hi, self.watch[v], first=v, hint=solution)
+            if found is None:
+                # It can't differ; this also helps the next searches
+                result[v] = value
+                lo[v] = hi[v] = value
+                self.propagate(lo, hi, self.watch[v])
+            else:
+                solution = found
+                for u, val in list(pure.items()):
+                    if solution[u]!=val:
+                        del pure[u]
+        return result
@@ -24,19 +24,24 @@ import sys
 import itertools
 import collections
 import time
+import io
 import os.path
 
 import common
 from common import *
+import level
 try:
-    from solver import *
+    from solver import solve, Session, Propagator, Stats, Cancelled
 except ImportError:
-    solve = None
+    # Solving is disabled (see MainWindow and Scene.solve_step)
+    solve = Session = Propagator = Stats = None
+    class Cancelled(Exception):
+        pass
 
 from qt import Signal
-from qt.core import QRectF, QTimer, QMargins, QByteArray
+from qt.core import QRectF, QTimer, QMargins, QByteArray, QThread
 from qt.gui import QPolygonF, QPen, QPainter, QTransform, QKeySequence, QBrush, QIcon
-from qt.widgets import QApplication, QGraphicsView, QMainWindow, QFileDialog, QShortcut, QAction, QVBoxLayout, QLabel, QWidget, QHBoxLayout
+from qt.widgets import QApplication, QGraphicsView, QMainWindow, QFileDialog, QShortcut, QAction, QVBoxLayout, QLabel, QWidget, QHBoxLayout, QInputDialog
 
 
 class Cell(common.Cell):
@@ -61,6 +66,9 @@ class Cell(common.Cell):
 
 
     def mousePressEvent(self, e):
+        # The solver is reading the cells
+        if self.scene().solving:
+            return
         if e.button()==qt.RightButton and self.scene().playtest and self.kind is not Cell.unknown:
             self.kind = Cell.unknown
             return
@@ -161,18 +169,68 @@ def _flower_poly():
     return result
 _flower_poly = _flower_poly()
 
+class SolveThread(QThread):
+    "Runs a solver step for Scene.solve_step, sending the deductions as they are found"
+    deduced = Signal(object)
+
+    def __init__(self, session, timeout=None, stats=None):
+        QThread.__init__(self)
+        self.session = session
+        self.stats = stats
+        self.deadline = None if timeout is None else time.time()+timeout
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        if self.cancelled or (self.deadline is not None and time.time()>self.deadline):
+            raise Cancelled()
+
+    def run(self):
+        deductions = []
+        last = time.time()
+        try:
+            for cell, value in self.session.solve(check=self.check, stats=self.stats):
+                deductions.append((cell, value))
+                if time.time()-last>0.1:
+                    self.deduced.emit(deductions)
+                    deductions = []
+                    last = time.time()
+        except Cancelled:
+            self.cancelled = True
+        if deductions:
+            self.deduced.emit(deductions)
+
+
 class Scene(common.Scene):
     text_changed = Signal()
+    # Emitted with a description of a finished solver step, if show_solver_stats
+    solver_stats = Signal(object)
+    # Seconds after which a solver step is given up
+    solve_timeout = 60
 
     def __init__(self):
         common.Scene.__init__(self)
         
         self.swap_buttons = False
+        self.show_solver_stats = False
         
         self.remaining = 0
         self.mistakes = 0
         
         self.solving = False
+        # The solver's model of the level, kept between steps
+        self.session = None
+        self.solve_thread = None
+        # Propagator of "Solve Completely", while it is going on
+        self._completing = None
+        # Cells waiting to be repainted
+        self._changed = []
+        self._upd_timer = QTimer()
+        self._upd_timer.setSingleShot(True)
+        self._upd_timer.setInterval(50)
+        self._upd_timer.timeout.connect(self._upd_changed)
 
     @event_property
     def remaining(self):
@@ -222,64 +280,124 @@ class Scene(common.Scene):
 
     
     def solve_step(self):
-        """Derive everything that can be concluded from the current state.
-        Return whether progress has been made."""
-        if self.solving:
+        """Start deriving everything that can be concluded from the current state.
+        Solving happens in the background; cells are marked as proven as they are found."""
+        if self.solving or Session is None:
             return
         self.confirm_proven()
+        self._start_solving()
+
+    def _start_solving(self):
+        if self.session is None:
+            self.session = Session(self)
+        # The thread must not touch the scene, so have the items ready
+        self.all_cells, self.all_columns
         self.solving = True
-        app.processEvents()
-        progress = False
-        for cell, value in solve(self):
+        self.progress = False
+        self.solve_thread = SolveThread(self.session, self.solve_timeout, Stats() if self.show_solver_stats else None)
+        self.solve_thread.deduced.connect(self._deduced)
+        self.solve_thread.finished.connect(self._solve_finished)
+        self.solve_thread.start()
+
+    def _deduced(self, deductions):
+        if self.sender() is not self.solve_thread:
+            return
+        for cell, value in deductions:
             try:
                 assert cell.actual==value
             except AssertionError:
                 cell.setPen(QPen(qt.red, 0.2))
                 raise
             cell.proven = True
+            self._changed.append(cell)
+            self.progress = True
+        # Repaint many cells at once rather than each as it comes
+        if not self._upd_timer.isActive():
+            self._upd_timer.start()
+
+    def _upd_changed(self):
+        for cell in self._changed:
             cell.upd()
-            progress = True
-        
+        self._changed = []
+
+    def _solve_finished(self):
+        thread = self.solve_thread
+        if thread is None or self.sender() is not thread:
+            return
+        self.solve_thread = None
         self.solving = False
-        
-        return progress
-    
+        self._upd_timer.stop()
+        self._upd_changed()
+        if thread.stats is not None:
+            self.solver_stats.emit(("Cancelled after " if thread.cancelled else "")+thread.stats.summary())
+        if self._completing is not None:
+            if self.progress and not thread.cancelled:
+                self._continue_complete()
+            else:
+                self._completing = None
+
+    def cancel_solving(self, wait=False):
+        "Stop solving; with `wait`, don't return until the thread has stopped"
+        self._completing = None
+        thread = self.solve_thread
+        if thread is None:
+            return
+        thread.cancel()
+        if wait:
+            thread.wait()
+            self.solve_thread = None
+            self.solving = False
+            self._changed = []
+
     def solve_complete(self):
-        """Continue solving until stuck.
-        Return whether the entire level could be uncovered."""
+        "Continue solving until stuck, in the background"
+        if self.solving or Session is None:
+            return
+        self._completing = Propagator(self)
+        self._continue_complete()
+
+    def _continue_complete(self):
+        propagator = self._completing
+        for cell in self.confirm_proven():
+            propagator.reveal(cell)
+
+        # Simple deductions, then ones from pairs of numbers,
+        # and only when those are exhausted the full solver
         while True:
-            self.confirm_proven()
-            app.processEvents()
-            
-            progress = True
-            while progress:
-                progress = False
-                for cell, value in solve_simple(self):
-                    progress = True
-                    try:
-                        assert cell.actual==value
-                    except AssertionError:
-                        cell.setPen(QPen(qt.red, 0.2))
-                        raise
-                    cell.kind = cell.actual
-                    cell.upd()
-            if not self.solve_step():
+            deductions = list(propagator.deductions()) or propagator.pair_deductions()
+            if not deductions:
                 break
-
-        
-        # If it identified all blue cells, it'll have the rest uncovered as well
-        return self.remaining == 0
+            for cell, value in deductions:
+                if cell.kind is not Cell.unknown:
+                    continue
+                try:
+                    assert cell.actual==value
+                except AssertionError:
+                    cell.setPen(QPen(qt.red, 0.2))
+                    raise
+                cell.kind = cell.actual
+                cell.upd()
+                propagator.reveal(cell)
+        if self.remaining:
+            self._start_solving()
+        else:
+            # If it identified all blue cells, it'll have the rest uncovered as well
+            self._completing = None
 
     def confirm_proven(self):
+        "Uncover the cells marked as proven; return them"
         if self.solving:
-            return
+            return []
+        result = []
         for cell in self.all(Cell):
             try:
                 del cell.proven
                 cell.kind = cell.actual
                 cell.upd()
+                result.append(cell)
             except AttributeError:
                 pass
+        return result
     def clear_proven(self):
         if self.solving:
             return
@@ -393,6 +511,11 @@ class MainWindow(QMainWindow):
         if not playtest:
             action = menu.addAction("&Open...", self.load_file, QKeySequence.Open)
             menu.addSeparator()
+            self.choose_level_action = action = menu.addAction("Choose &Level from Pack...", self.choose_from_pack, QKeySequence('Ctrl+L'))
+            action.setStatusTip("Choose another level from the level pack that is open.")
+            self.next_level_action = action = menu.addAction("&Next Level in Pack", lambda: self.load_from_pack(self.pack_index+1), QKeySequence('Ctrl+PgDown'))
+            self.previous_level_action = action = menu.addAction("&Previous Level in Pack", lambda: self.load_from_pack(self.pack_index-1), QKeySequence('Ctrl+PgUp'))
+            menu.addSeparator()
             action = menu.addAction("&Paste from Clipboard", self.paste, QKeySequence('Ctrl+V'))
             menu.addSeparator()
 
@@ -408,6 +531,12 @@ class MainWindow(QMainWindow):
         
         self.swap_buttons_action = action = make_check_action("&Swap Buttons", self, self.scene, 'swap_buttons')
         menu.addAction(action)
+        
+        self.show_solver_stats_action = action = make_check_action("Show Solver S&tatistics", self, self.scene, 'show_solver_stats')
+        action.toggled.connect(self.statusBar().setVisible)
+        menu.addAction(action)
+        self.statusBar().hide()
+        self.scene.solver_stats.connect(self.statusBar().showMessage)
 
         
         menu = self.menuBar().addMenu("&Solve")
@@ -422,6 +551,8 @@ class MainWindow(QMainWindow):
         menu.addSeparator()
         
         menu.addAction("&Solve Completely", self.scene.solve_complete, QKeySequence("Shift+S"))
+        
+        menu.addAction("C&ancel", self.scene.cancel_solving, QKeySequence("Esc"))
 
         
         menu = self.menuBar().addMenu("&Help")
@@ -432,6 +563,9 @@ class MainWindow(QMainWindow):
         
         
         self.last_used_folder = None
+        self.pack = None
+        self.pack_index = 0
+        self.upd_pack_actions()
         
         self.reset()
         
@@ -445,6 +579,7 @@ class MainWindow(QMainWindow):
     
     config_format = '''
         swap_buttons = swap_buttons_action.isChecked(); swap_buttons_action.setChecked(v)
+        show_solver_stats = show_solver_stats_action.isChecked(); show_solver_stats_action.setChecked(v)
         last_used_folder
         window_geometry_qt = save_geometry_qt(); restore_geometry_qt(v)
     '''
@@ -454,10 +589,12 @@ class MainWindow(QMainWindow):
         self.restoreGeometry(QByteArray.fromBase64(value.encode('ascii')))
     
     def reset(self):
+        self.scene.cancel_solving(wait=True)
         self.current_file = None
         self.scene.clear()
         self.scene.remaining = 0
         self.scene.mistakes = 0
+        self.scene.session = None
         for it in [self.title_label, self.author_align_label, self.author_label, self.information_label]:
             it.hide()
         try:
@@ -502,12 +639,20 @@ class MainWindow(QMainWindow):
                 dialog = QFileDialog.getOpenFileNameAndFilter
             except AttributeError:
                 dialog = QFileDialog.getOpenFileName
-            fn, _ = dialog(self, "Open", filter="Hexcells/SixCells Level (*.hexcells *sixcells *.sixcellz)")
+            fn, _ = dialog(self, "Open", filter="Hexcells/SixCells Level (*.hexcells *sixcells *.sixcellz *.sixcellb);;SixCells Level Pack (*.sixcellp)")
         if not fn:
             return
+        if isinstance(fn, basestring) and fn.endswith('.sixcellp'):
+            return self.load_pack(fn)
+        self.pack = None
+        self.upd_pack_actions()
         self.reset()
         if isinstance(fn, basestring) and fn.endswith('.hexcells'):
             self.load_hexcells_file(fn)
+        elif isinstance(fn, basestring) and fn.endswith('.sixcellb'):
+            if not load_binary(fn, self.scene, Cell=Cell, Column=Column):
+                self.reset()
+                return
         else:
             gz = isinstance(fn, basestring) and fn.endswith('.sixcellz')
             if not load_file(fn, self.scene, gz=gz, Cell=Cell, Column=Column):
@@ -519,6 +664,53 @@ class MainWindow(QMainWindow):
             self.last_used_folder = os.path.dirname(fn)
         return True
     
+    def load_pack(self, fn):
+        try:
+            pack = level.Pack(fn)
+        except (ValueError, EnvironmentError) as e:
+            QMessageBox.critical(None, "Error", str(e))
+            return
+        if not len(pack):
+            QMessageBox.warning(None, "Warning", "This level pack is empty.")
+            return
+        self.pack, self.pack_file, self.pack_index = pack, fn, 0
+        self.last_used_folder = os.path.dirname(fn)
+        self.upd_pack_actions()
+        return self.choose_from_pack()
+    
+    def choose_from_pack(self):
+        items = [
+            "{}. {}{} ({} cells)".format(i+1, it['title'] or "Untitled", " by "+it['author'] if it['author'] else '', it['cells'])
+            for i, it in enumerate(self.pack.levels)
+        ]
+        item, ok = QInputDialog.getItem(self, "Level Pack", "Level:", items, self.pack_index, False)
+        if ok:
+            return self.load_from_pack(items.index(item))
+    
+    def load_from_pack(self, i):
+        "Load the level number `i` from the level pack that is open, reading only that level"
+        if self.pack is None or not 0<=i<len(self.pack):
+            return
+        self.reset()
+        try:
+            self.pack.load(i, self.scene, Cell=Cell, Column=Column)
+        except ValueError as e:
+            QMessageBox.critical(None, "Error", str(e))
+            self.reset()
+            return
+        self.pack_index = i
+        self._prepare()
+        self.current_file = self.pack_file
+        self.upd_pack_actions()
+        return True
+    
+    def upd_pack_actions(self):
+        if self.playtest:
+            return
+        self.choose_level_action.setEnabled(self.pack is not None)
+        self.next_level_action.setEnabled(self.pack is not None and self.pack_index+1<len(self.pack))
+        self.previous_level_action.setEnabled(self.pack is not None and self.pack_index>0)
+    
     def _prepare(self):
         if not self.playtest:
             self.view.fit()
@@ -552,6 +744,8 @@ class MainWindow(QMainWindow):
         f = io.StringIO()
         f.write(text)
         f.seek(0)
+        self.pack = None
+        self.upd_pack_actions()
         if not self.load_hexcells_file(f):
             self.reset()
             return
@@ -559,7 +753,7 @@ class MainWindow(QMainWindow):
 
 
     def closeEvent(self, e):
-        self.scene.solving = False
+        self.scene.cancel_solving(wait=True)
 
         cfg = save_config(self, self.config_format)
         with open(here('player.cfg'), 'w') as cfg_file:
@@ -21,16 +21,100 @@
 
 from __future__ import division, print_function
 
+import os
 import os.path
+import time
+import itertools
+import collections
 import distutils.spawn
 
-from pulp import *
+try:
+    from pulp import *
+except ImportError:
+    GLPK = None
 
-from common import *
+from util import *
+from level import Cell
+import native as _native
+
+
+class NativeSolver(object):
+    "Stands for the built-in solver (see native.py) where a PuLP solver is expected"
+    def available(self):
+        return True
+    def __repr__(self):
+        return 'native'
+native = NativeSolver()
+
+
+class Cancelled(Exception):
+    "Raised to interrupt solving (see Session.solve)"
+
+
+class Stats(object):
+    """Measurements of the calls of Session.solve that it is passed to:
+    seconds spent in each phase, number of solver invocations,
+    size of the problems and number of deductions.
+    Phases solved in a pool add up the time spent in all the processes."""
+
+    def __init__(self):
+        self.runs = []
+
+    def begin(self):
+        "Start measuring a new call"
+        self._run = collections.OrderedDict()
+        self._run['time'] = collections.OrderedDict()
+        self.runs.append(self._run)
+        self._clock = time.time()
+
+    def lap(self, phase):
+        "Count the time since the previous lap (or the beginning) towards `phase`"
+        now = time.time()
+        _add(self._run['time'], phase, now-self._clock)
+        self._clock = now
+
+    def add(self, key, value=1):
+        _add(self._run, key, value)
+
+    def add_times(self, times):
+        for phase, seconds in times.items():
+            _add(self._run['time'], phase, seconds)
+
+    def report(self):
+        "Return the measurements as a dict of the calls and their totals, suitable for JSON"
+        total = collections.OrderedDict()
+        total['time'] = collections.OrderedDict()
+        for run in self.runs:
+            for key, value in run.items():
+                if key=='time':
+                    for phase, seconds in value.items():
+                        _add(total['time'], phase, seconds)
+                else:
+                    _add(total, key, value)
+        return collections.OrderedDict([('calls', len(self.runs)), ('total', total), ('runs', self.runs)])
+
+    def summary(self):
+        "A line of text describing the last call"
+        if not self.runs:
+            return ''
+        run = self.runs[-1]
+        times = run['time']
+        return "{:.0f} ms ({}), {} solver calls, {} variables, {} constraints, {} deductions".format(
+            sum(times.values())*1000,
+            ', '.join('{} {:.0f}'.format(phase, seconds*1000) for phase, seconds in times.items()),
+            run.get('invocations', 0), run.get('variables', 0), run.get('constraints', 0), run.get('deductions', 0),
+        )
+
+def _add(counts, key, value):
+    counts[key] = counts.get(key, 0)+value
 
 
 # Should return the solver that will be
-# invoked by PuLP to solve the MILPs.
+# invoked by PuLP to solve the MILPs,
+# or `native` to solve them in-process without PuLP.
+# The environment variable SIXCELLS_SOLVER can be set to
+# 'native', 'glpk' or 'pulp' (PuLP's default) to skip the search;
+# if PuLP or glpsol can't be found for these, the built-in solver is used.
 def get_solver():
     global solver
     try:
@@ -38,6 +122,32 @@ def get_solver():
     except NameError:
         pass
     
+    choice = os.environ.get('SIXCELLS_SOLVER', '').lower()
+    if choice=='native' or GLPK is None:
+        if choice in ('glpk', 'pulp'):
+            print("PuLP is not installed; using the built-in solver")
+        solver = native
+        return solver
+    if choice=='pulp':
+        solver = None
+        return solver
+    
+    solver = _find_glpk()
+    if solver is not None:
+        return solver
+    if choice=='glpk':
+        print("GLPK requested, but glpsol was not found; using the built-in solver")
+        solver = native
+        return solver
+    
+    # Other OS: There will be no glpsol.exe, but we don't need one:
+    #           Assume there is a solver installed and
+    #           have pulp find and decide on one.
+    print("No solver found; a default may be found")
+    solver = None
+    return None
+
+def _find_glpk():
     # Windows: The glpsol.exe and glpsol*.dll should be
     #          provided by user. However, PuLP will not
     #          find them, even if they are in the current
@@ -59,126 +169,272 @@ def get_solver():
         if solver.available():
             print("Using GLPK:", path)
             return solver
-    
-    # Other OS: There will be no glpsol.exe, but we don't need one:
-    #           Assume there is a solver installed and
-    #           have pulp find and decide on one.
-    print("No solver found; a default may be found")
-    solver = None
-    return None
-
 
 
 def solve_simple(scene):
-    for cur in itertools.chain(scene.all_cells, scene.all_columns):
-        if isinstance(cur, Cell) and cur.kind is Cell.unknown:
-            continue
-        if cur.value is not None and any(x.kind is Cell.unknown for x in cur.members):
+    return Propagator(scene).deductions()
+
+
+class Propagator(object):
+    """The deductions of solve_simple, made incrementally:
+    the blue, black and unknown members of every number are counted
+    and only the numbers whose members changed are looked at again.
+    Call `reveal` for each cell that becomes known, e.g. after acting on a deduction."""
+
+    def __init__(self, scene):
+        # Counts of full, empty and unknown members by known cell or column
+        self._counts = {}
+        # Numbers that the unknown cell is a member of
+        self._containing = collections.defaultdict(list)
+        # Numbers to look at
+        self._queue = collections.deque()
+        self._queued = set()
+
+        known = (cell for cell in scene.all_cells if cell.kind is not Cell.unknown)
+        for cur in itertools.chain(known, scene.all_columns):
+            self._add(cur)
+
+    def _add(self, cur):
+        if cur.value is None or cur in self._counts:
+            return
+        counts = [0, 0, 0]
+        for x in cur.members:
+            if x.kind is Cell.full:
+                counts[0] += 1
+            elif x.kind is Cell.empty:
+                counts[1] += 1
+            else:
+                counts[2] += 1
+                self._containing[x].append(cur)
+        self._counts[cur] = counts
+        self._push(cur)
+
+    def _push(self, cur):
+        if cur not in self._queued:
+            self._queued.add(cur)
+            self._queue.append(cur)
+
+    def reveal(self, cell):
+        "Take into account that `cell` has become known"
+        for cur in self._containing.pop(cell, ()):
+            counts = self._counts[cur]
+            counts[2] -= 1
+            counts[0 if cell.kind is Cell.full else 1] += 1
+            self._push(cur)
+        self._add(cell)
+
+    def deductions(self):
+        "Yield (cell, kind) for unknown cells that follow directly from a number"
+        while self._queue:
+            cur = self._queue.popleft()
+            self._queued.discard(cur)
+            full, empty, unknown = self._counts[cur]
+            if not unknown:
+                continue
             # Fill up remaining fulls
-            if cur.value==sum(1 for x in cur.members if x.kind is not Cell.empty):
-                for x in cur.members:
-                    if x.kind is Cell.unknown:
-                        yield x, Cell.full
+            if cur.value==full+unknown:
+                kind = Cell.full
             # Fill up remaining empties
-            if len(cur.members)-cur.value==sum(1 for x in cur.members if x.kind is not Cell.full):
-                for x in cur.members:
-                    if x.kind is Cell.unknown:
-                        yield x, Cell.empty
-
-
-def solve(scene):
-    # Get Relevant Game Data:
-    # cells:   All cells (regardless of state)
-    # columns: All columns
-    # known: revealed cells
-    # unknown: unrevealed cells
-    # solver: MILP program to use
-    
-    cells   = scene.all_cells
-    columns = scene.all_columns
-    known   = [cell for cell in cells if cell.kind is not Cell.unknown]
-    unknown = [cell for cell in cells if cell.kind is Cell.unknown]
-    
-    ####################################################
-    #   -- Equivalance Class Optimisation --
-    ####################################################
-    
-    # We say, two unknown cells are equivalent if they are subject
-    # to the same constraints (not just equal, but the same)
-    # if a cell can be blue/black then an equivalent cell has those
-    # options two, since they can switch places without affecting constraints
-    # *Unless* there are togetherness constraints involved (see below).
-    # Idea: Have one variable for each class with range 0 to the size of the class
-    # This models the number of hexes in the class that are blue.
-    # The hexes of the class are blue (black)
-    # iff we can prove the variable assumes its max (min)
-    
-    # cellConstraints: Maps a cell to all relevant
-    # constraints (cells and columns) that it is a member of
-    cellConstraints = collections.defaultdict(set)
-    for cur in itertools.chain(known, columns):
-        # Ignore uninformative constraints
-        if (cur.value is None):
-            continue
-        for x in cur.members:
-            cellConstraints[x].add(cur)
-    
-    # Cells are now equivalent iff their cellConstraints match.
-    # The leftmost cell in the collection is the representative,
-    # i.e. repOf[cell] points to the leftmost cell that is equivalent to cell.
-    # note that this is well-defined since cells are equivalent to themselves.
-    # repOf[cell] is the representative of the equivalance class of cell.
-    repOf = {}
-    for cell1 in unknown:
-        for cell2 in unknown:
-            if cellConstraints[cell1] == cellConstraints[cell2]:
-                repOf[cell1] = cell2
-    
-    # since cells subject to togetherness constraints cannot swap places (they are a special case)
-    # they must be their own representative and cannot be considered equivalent
-    # to anyone but themselves.
-    for cell in unknown:
-        for constraint in cellConstraints[cell]:
-           if constraint.together is not None:
-                repOf[cell] = cell
-    
-    # from now on it will suffice to find information on equivalance classes
-    # a class is a pair of one representative and the size of the class
-    classes = {rep : sum(1 for cell in unknown if repOf[cell] is rep) for rep in unknown if repOf[rep] is rep}
-    
-    ####################################################
-    #     -- The MILP Problem (managed by PuLP) --
-    ####################################################
-    
-    solver  = get_solver()
-    problem = LpProblem('HexcellsMILP', LpMinimize)
-    
-    # For every equivalance class of cells there is a integer variable,
-    # modeling the number of blue cells in that class.
-    # The class is blue (or black) iff we can prove that the variable
-    # is necessarily the size of the class (or 0)
-    # This Dictionary maps a cell id to the respective variable.
-    dic = { rep.id : LpVariable('v'+str(rep.id), lowBound = 0, upBound = size, cat = 'Integer') for rep, size in classes.items() }
-    
-    # Convenience: Maps a cell to the corresponding variable or constant:
-    # Note that the cells of a class will appear in the same constraints,
-    # so we ignore every cell but the representative.
-    def get_var(cell):
-        if cell.kind is not Cell.unknown: #cell is constant
-            return 1 if cell.kind is Cell.full else 0 
-        elif repOf[cell] is cell: #cell is representative
-            return dic[cell.id] 
-        else: # cell is non representative
-            return 0 
-    
-    # The number of remaining blue hexes is known
-    problem += lpSum(get_var(cell) for cell in unknown) == scene.remaining
-    
+            elif len(cur.members)-cur.value==empty+unknown:
+                kind = Cell.empty
+            else:
+                continue
+            for x in cur.members:
+                if x.kind is Cell.unknown:
+                    yield x, kind
+
+    def pair_deductions(self):
+        """Return a list of (cell, kind) for unknown cells that follow
+        from comparing two numbers that share unknown members."""
+        # For numbers a and b, with unknown members A and B, let I be the cells in both.
+        # The blue cells in I can't be more than either number still needs,
+        # and the rest of A (or B) must make up for what I doesn't have.
+        result = collections.OrderedDict()
+        seen = set()
+        for x, containing in list(self._containing.items()):
+            if x.kind is not Cell.unknown:
+                continue
+            for a, b in itertools.combinations(containing, 2):
+                if (a, b) in seen:
+                    continue
+                seen.add((a, b))
+                seen.add((b, a))
+
+                members_a = set(m for m in a.members if m.kind is Cell.unknown)
+                members_b = set(m for m in b.members if m.kind is Cell.unknown)
+                both = [m for m in a.members if m in members_a and m in members_b]
+                only_a = [m for m in a.members if m in members_a and m not in members_b]
+                only_b = [m for m in b.members if m in members_b and m not in members_a]
+                need_a = a.value-self._counts[a][0]
+                need_b = b.value-self._counts[b][0]
+
+                # Bounds of the number of blue cells in both
+                lo = max(need_a-len(only_a), need_b-len(only_b), 0)
+                hi = min(need_a, need_b, len(both))
+                if lo>hi:
+                    continue
+                for cells, need in [(only_a, need_a), (only_b, need_b)]:
+                    if not cells:
+                        continue
+                    if need-hi==len(cells):
+                        result.update((m, Cell.full) for m in cells)
+                    elif need-lo==0:
+                        result.update((m, Cell.empty) for m in cells)
+                if lo==len(both):
+                    result.update((m, Cell.full) for m in both)
+                elif hi==0:
+                    result.update((m, Cell.empty) for m in both)
+        return list(result.items())
+
+
+def solve(scene, pool=None, stats=None):
+    # pool: optionally, something with an `imap` method (like multiprocessing.Pool)
+    #       to solve independent parts of the level in parallel
+    # stats: optionally, a Stats object to record measurements in
+    return Session(scene).solve(pool, stats=stats)
+
+
+def solve_complete(scene, pool=None, check=None, stats=None):
+    """Uncover everything that can be deduced in a level.Level prepared for playing,
+    like "Solve Completely" in the player.
+    Return the number of steps made with the full solver and the number of those
+    that the deductions from pairs of numbers made unnecessary.
+    The other arguments are passed to Session.solve."""
+    session = Session(scene)
+    propagator = Propagator(scene)
+    steps = avoided = 0
+    while True:
+        for cell, value in propagator.deductions():
+            assert cell.actual==value
+            scene.reveal(cell)
+            propagator.reveal(cell)
+
+        deduced = propagator.pair_deductions()
+        if deduced:
+            avoided += 1
+        else:
+            steps += 1
+            deduced = list(session.solve(pool, check, stats))
+        if not deduced:
+            return steps, avoided
+        for cell, value in deduced:
+            assert cell.actual==value
+            if cell.kind is Cell.unknown:
+                scene.reveal(cell)
+                propagator.reveal(cell)
+
+
+def count_solutions(scene, limit=2, check=None):
+    # See Session.count_solutions
+    return Session(scene).count_solutions(limit, check)
+
+
+class Session(object):
+    """The problem of a level, kept between calls of `solve`
+    so that only what changed since the previous call needs to be looked at.
+    Cells are expected to only ever become known; otherwise everything is rebuilt."""
+
+    def __init__(self, scene):
+        self.scene = scene
+        # Results of the problems solved in the previous call, by problem
+        self._cache = {}
+        self._reset()
+
+    def _reset(self):
+        # Cells that are known and have been taken into account
+        self._known = set()
+
+        # Every constraint is a list [terms, lo, hi], meaning that
+        # lo <= sum(coef*cell for cell, coef in terms.items()) <= hi
+        # where cell is 1 if blue, 0 if black.
+        # lo or hi may be None if there is no such bound.
+        # terms only has unknown cells; known cells are taken out when they get revealed.
+        self._constraints = collections.OrderedDict()
+        # Indexes of the constraints that a cell is in
+        self._containing = collections.defaultdict(list)
+        self._count = 0
+
+        # The equivalence classes of the unknown cells (see equivalence_classes),
+        # kept up to date as cells become known, so that only the cells around those are looked at.
+        # The position of each cell in the scene decides the representative of its class.
+        self._position = {cell: i for i, cell in enumerate(self.scene.all_cells)}
+        # The known cells and columns with a value that each unknown cell is a member of
+        self._memberships = collections.defaultdict(list)
+        # Unknown cells that are subject to togetherness, so they are a class of their own
+        self._alone = set()
+        # The key of each unknown cell's class, and the cells of each class by its key
+        self._class_key = {}
+        self._classes = {}
+        # The representative of each class, and the classes that have changed since it was found
+        self._reps = {}
+        self._changed_classes = set()
+        # The terms of each constraint for the representatives only,
+        # and the indexes of the constraints whose terms have to be found again
+        self._class_terms = {}
+        self._stale = set()
+
+        for cell in self.scene.all_cells:
+            if cell.kind is Cell.unknown:
+                self._set_class(cell, frozenset())
+        for col in self.scene.all_columns:
+            self._add_column(col)
+
+    def _set_class(self, cell, key):
+        "Move `cell` to the class with `key`, or out of all classes if `key` is None"
+        old = self._class_key.pop(cell, None)
+        if old is not None:
+            cells = self._classes[old]
+            cells.discard(cell)
+            if not cells:
+                del self._classes[old]
+            self._changed_classes.add(old)
+        if key is not None:
+            self._class_key[cell] = key
+            self._classes.setdefault(key, set()).add(cell)
+            self._changed_classes.add(key)
+        self._stale.update(self._containing.get(cell, ()))
+
+    def _inform(self, informer):
+        "Take into account that `informer` (a known cell or a column) tells something about its members"
+        if informer.value is None:
+            return
+        for cell in informer.members:
+            if cell not in self._class_key:
+                continue
+            self._memberships[cell].append(informer)
+            if informer.together is not None:
+                self._alone.add(cell)
+            # Cells with the same informers are equivalent, unless togetherness is involved
+            self._set_class(cell, cell if cell in self._alone else frozenset(self._memberships[cell]))
+
+    # Convenience: Adds a constraint on a sum of (cell, coef) pairs.
+    # Known cells are constants (1 if blue, 0 if black).
+    def _add(self, cell_terms, lo=None, hi=None):
+        terms = collections.OrderedDict()
+        const = 0
+        for cell, coef in cell_terms:
+            if cell.kind is not Cell.unknown: #cell is constant
+                if cell.kind is Cell.full:
+                    const += coef
+            else:
+                terms[cell] = terms.get(cell, 0)+coef
+        if not terms: # nothing to decide here
+            return
+        index = self._count
+        self._count += 1
+        self._constraints[index] = [terms, None if lo is None else lo-const, None if hi is None else hi-const]
+        self._stale.add(index)
+        for cell in terms:
+            self._containing[cell].append(index)
+
     # Constraints from column number information
-    for col in columns:
+    def _add_column(self, col):
+        self._inform(col)
+        add = self._add
+
         # The sum of all cells in that column is the column value
-        problem += lpSum(get_var(cell) for cell in col.members) == col.value
-        
+        add(((cell, 1) for cell in col.members), col.value, col.value)
+
         # Additional information (together/seperated) available?
         if col.together is not None:
             if col.together:
@@ -186,18 +442,21 @@ def solve(scene):
                 # Example: For {3}, the configurations X??X, X???X, X????X, ... are impossible.
                 for span in range(col.value, len(col.members)):
                     for start in range(len(col.members) - span):
-                        problem += lpSum([get_var(col.members[start]), get_var(col.members[start+span])]) <= 1
+                        add([(col.members[start], 1), (col.members[start+span], 1)], hi=1)
             else:
                 # For -n-, the sum of any range of n cells may contain at most n-1 blues
                 for offset in range(len(col.members) - col.value + 1):
-                    problem += lpSum(get_var(col.members[offset+i]) for i in range(col.value)) <= col.value - 1
-    
+                    add(((col.members[offset+i], 1) for i in range(col.value)), hi=col.value-1)
+
     # Constraints from cell number information
-    for cell in known:
+    def _add_cell(self, cell):
+        self._inform(cell)
+        add = self._add
+
         # If the displays a number, the sum of its neighbourhood (radius 1 or 2) is known
         if cell.value is not Cell.unknown:
-            problem += lpSum(get_var(neighbour) for neighbour in cell.members) == cell.value
-        
+            add(((neighbour, 1) for neighbour in cell.members), cell.value, cell.value)
+
         # Additional togetherness information available?
         # Note: Only relevant if value between 2 and 4.
         # In fact: The following code would do nonsense for 0,1,5,6!
@@ -206,7 +465,7 @@ def solve(scene):
             # Convenience: Have it wrap around.
             def m(x):
                 return cell.members[x % len(cell.members)]
-            
+
             if cell.together:
                 # note how togetherness is equivalent to the following
                 # two patterns not occuring: "-X-" and the "X-X"
@@ -218,74 +477,433 @@ def solve(scene):
                     # That means: -m(i-1) +m(i) -m(i+1) <= 0
                     # Note that m(i+1) and m(i-1) only count
                     # if they are real neighbours.
-                    cond = get_var(m(i))
+                    cond = [(m(i), 1)]
                     if m(i).is_neighbor(m(i-1)):
-                        cond -= get_var(m(i-1))
+                        cond.append((m(i-1), -1))
                     if m(i).is_neighbor(m(i+1)):
-                        cond -= get_var(m(i+1))
-                        
+                        cond.append((m(i+1), -1))
+
                     # no isolated cell
-                    problem += cond <= 0
                     # no isolated gap (works by a similar argument)
-                    problem += cond >= -1
+                    add(cond, -1, 0)
             else:
                 # -n-: any circular range of n cells contains at most n-1 blues.
                 for i in range(len(cell.members)):
                     # the range m(i), ..., m(i+n-1) may not all be blue if they are consecutive
                     if all(m(i+j).is_neighbor(m(i+j+1)) for j in range(cell.value-1)):
-                        problem += lpSum(get_var(m(i+j)) for j in range(cell.value)) <= cell.value-1
+                        add(((m(i+j), 1) for j in range(cell.value)), hi=cell.value-1)
+
+    def update(self):
+        "Take into account the cells that became known since the last call"
+        known = [cell for cell in self.scene.all_cells if cell.kind is not Cell.unknown]
+        revealed = [cell for cell in known if cell not in self._known]
+        if len(known)-len(revealed)!=len(self._known):
+            # Some cell became unknown again
+            self._reset()
+            revealed = known
+
+        # Known cells become constants in the constraints they are in
+        for cell in revealed:
+            self._known.add(cell)
+            self._set_class(cell, None)
+            self._memberships.pop(cell, None)
+            self._alone.discard(cell)
+            for index in self._containing.pop(cell, ()):
+                constraint = self._constraints[index]
+                terms, lo, hi = constraint
+                coef = terms.pop(cell)
+                if cell.kind is Cell.full:
+                    constraint[1] = None if lo is None else lo-coef
+                    constraint[2] = None if hi is None else hi-coef
+                if not terms:
+                    del self._constraints[index]
+                    self._class_terms.pop(index, None)
+                    self._stale.discard(index)
+        for cell in revealed:
+            self._add_cell(cell)
+
+    def _problem(self, stats):
+        """The problem of finding the blue and black unknown cells, in terms of their classes.
+        Return the representatives of the classes, the class sizes and the constraints (see below)."""
+        self.update()
+        stats.lap('update')
+
+        ####################################################
+        #   -- Equivalance Class Optimisation --
+        ####################################################
+
+        # We say, two unknown cells are equivalent if they are subject
+        # to the same constraints (not just equal, but the same)
+        # if a cell can be blue/black then an equivalent cell has those
+        # options two, since they can switch places without affecting constraints
+        # *Unless* there are togetherness constraints involved (see equivalence_classes).
+        # Idea: Have one variable for each class with range 0 to the size of the class
+        # This models the number of hexes in the class that are blue.
+        # The hexes of the class are blue (black)
+        # iff we can prove the variable assumes its max (min)
+
+        # The classes are kept by update; only the representatives
+        # of the ones that changed (the leftmost cell) are looked for again.
+        position = self._position
+        for key in self._changed_classes:
+            old = self._reps.pop(key, None)
+            cells = self._classes.get(key)
+            new = min(cells, key=position.__getitem__) if cells else None
+            if new is not None:
+                self._reps[key] = new
+            if new is not old:
+                for cell in (old, new):
+                    if cell is not None:
+                        self._stale.update(self._containing.get(cell, ()))
+        self._changed_classes.clear()
+        reps = sorted(self._reps.values(), key=position.__getitem__)
+        stats.lap('classes')
+
+        ####################################################
+        #     -- The Constraints --
+        ####################################################
+
+        # From now on, classes are numbered and the problem is just numbers,
+        # so that parts of it can be sent to other processes.
+        # Every constraint is a tuple (terms, lo, hi) like the ones kept by the session,
+        # but terms is a list of (class number, coef).
+        # Note that the cells of a class will appear in the same constraints,
+        # so we ignore every cell but the representative.
+        # Which cells those are is only found again for the constraints with cells that changed class.
+        class_key = self._class_key
+        for index in self._stale:
+            terms = self._constraints[index][0]
+            self._class_terms[index] = [
+                (cell, coef) for cell, coef in terms.items() if self._reps[class_key[cell]] is cell
+            ]
+        self._stale.clear()
+        number = {rep: i for i, rep in enumerate(reps)}
+        sizes = [len(self._classes[class_key[rep]]) for rep in reps]
+        constraints = [
+            ([(number[cell], coef) for cell, coef in self._class_terms[index]], lo, hi)
+            for index, (terms, lo, hi) in self._constraints.items()
+        ]
+        stats.add('cells', len(class_key))
+        stats.add('variables', len(sizes))
+        stats.add('constraints', len(constraints))
+        stats.lap('constraints')
+        return reps, sizes, constraints
+
+    def _members(self, rep):
+        "The cells in the class of the representative `rep`, in the order of the scene"
+        return sorted(self._classes[self._class_key[rep]], key=self._position.__getitem__)
+
+    def solve(self, pool=None, check=None, stats=None):
+        """Find the unknown cells that can be proven to be blue or black.
+        Yield (cell, kind) pairs, one independent part of the level at a time.
+        `check`, if given, is called now and then while solving in this process;
+        it can raise an exception (like Cancelled) to interrupt solving.
+        `stats`, if given, is a Stats object to record measurements in."""
+        if stats is None:
+            stats = Stats()
+        stats.begin()
+
+        reps, sizes, constraints = self._problem(stats)
+
+        ####################################################
+        #     -- Independent Components --
+        ####################################################
+
+        # Classes that don't share any constraints (directly or through other classes)
+        # can be solved separately, and a big level is mostly made of such islands.
+        # The number of remaining blue hexes connects all cells, so it is left out.
+        # That is a relaxation, so whatever is proven without it is true,
+        # but some cells may be provable only with it. Those are looked for
+        # (in the problem as a whole) only when the islands give nothing.
+        solver = get_solver()
+        jobs = []
+        components = _components(len(sizes), constraints)
+        if len(components)>1:
+            for group, group_constraints in components:
+                local = {v: i for i, v in enumerate(group)}
+                jobs.append((
+                    group,
+                    ([sizes[v] for v in group], [([(local[v], a) for v, a in terms], lo, hi) for terms, lo, hi in group_constraints], solver)
+                ))
+        stats.add('components', len(jobs))
+        stats.lap('components')
+        cache, self._cache = self._cache, {}
+        found = False
+        for v, kind in _run_jobs(jobs, pool, cache, self._cache, check, stats):
+            found = True
+            members = self._members(reps[v])
+            stats.add('deductions', len(members))
+            for cell in members:
+                yield cell, kind
+        if not found and sizes:
+            everything = list(range(len(sizes)))
+            # The number of remaining blue hexes is known
+            constraints.append(([(v, 1) for v in everything], self.scene.remaining, self.scene.remaining))
+            for v, kind in _run_jobs([(everything, (sizes, constraints, solver))], None, cache, self._cache, check, stats):
+                members = self._members(reps[v])
+                stats.add('deductions', len(members))
+                for cell in members:
+                    yield cell, kind
+
+    def count_solutions(self, limit=2, check=None):
+        """Count the ways to make the unknown cells blue or black so that
+        everything known about the level holds, but stop as soon as `limit` are found.
+        So the result is 1 iff the solution is unique, and `limit` means "at least that many".
+        Solutions are always counted by the built-in solver (native.py)."""
+        stats = Stats()
+        stats.begin()
+        reps, sizes, constraints = self._problem(stats)
+        problem = _native.Problem()
+        problem.check = check
+        for size in sizes:
+            problem.add_var(0, size)
+        for terms, lo, hi in constraints:
+            problem.add(terms, lo, hi)
+        problem.add([(v, 1) for v in range(len(sizes))], self.scene.remaining, self.scene.remaining)
+
+        count = 0
+        for solution in problem.solutions():
+            # A class with k blue cells out of n can have them in any n-choose-k places
+            ways = 1
+            for size, value in zip(sizes, solution):
+                ways *= _binomial(size, value)
+            count += ways
+            if count>=limit:
+                return limit
+        return count
+
+
+def _binomial(n, k):
+    result = 1
+    for i in range(min(k, n-k)):
+        result = result*(n-i)//(i+1)
+    return result
+
+
+def equivalence_classes(unknown, informers):
+    """Group the `unknown` cells by the constraints (the items in `informers`,
+    i.e. known cells and columns, that have a value) they are members of.
+    Return (repOf, classes): the representative of each cell's class
+    and the size of each class by its representative."""
+
+    # cellConstraints: Maps a cell to all relevant
+    # constraints (cells and columns) that it is a member of
+    cellConstraints = collections.defaultdict(list)
+    for cur in informers:
+        # Ignore uninformative constraints
+        if (cur.value is None):
+            continue
+        for x in cur.members:
+            cellConstraints[x].append(cur)
+
+    # Cells are now equivalent iff their cellConstraints match,
+    # so the set of constraints is used as a key to find the class.
+    # The leftmost cell in the collection is the representative,
+    # i.e. repOf[cell] points to the leftmost cell that is equivalent to cell.
+    # repOf[cell] is the representative of the equivalance class of cell.
+    # Since cells subject to togetherness constraints cannot swap places (they are a special case)
+    # they must be their own representative and cannot be considered equivalent
+    # to anyone but themselves.
+    repOf = {}
+    classes = collections.OrderedDict()
+    by_key = {}
+    for cell in unknown:
+        constraints = cellConstraints[cell]
+        if any(constraint.together is not None for constraint in constraints):
+            rep = cell
+        else:
+            rep = by_key.setdefault(frozenset(constraints), cell)
+        repOf[cell] = rep
+        classes[rep] = classes.get(rep, 0)+1
+    return repOf, classes
+
+
+def _components(count, constraints):
+    """Split the variables 0..count-1 into groups that don't share constraints.
+    Return a list of (variables, constraints) for the groups that have any constraints."""
+    parent = list(range(count))
+    def find(v):
+        while parent[v]!=v:
+            parent[v] = parent[parent[v]]
+            v = parent[v]
+        return v
+    for terms, lo, hi in constraints:
+        root = find(terms[0][0])
+        for v, _ in terms[1:]:
+            other = find(v)
+            if other!=root:
+                parent[other] = root
+
+    groups = collections.OrderedDict()
+    for terms, lo, hi in constraints:
+        groups.setdefault(find(terms[0][0]), []).append((terms, lo, hi))
+    members = collections.defaultdict(list)
+    for v in range(count):
+        members[find(v)].append(v)
+    return [(members[root], group_constraints) for root, group_constraints in groups.items()]
+
+
+def _run_jobs(jobs, pool, cache=None, new_cache=None, check=None, stats=None):
+    """Solve each of the problems (variables, (sizes, constraints, solver)),
+    in `pool` (something with an `imap` method, like multiprocessing.Pool) if given.
+    Problems found in the dict `cache` aren't solved again;
+    all the problems and their solutions are put into `new_cache`, if given.
+    Yield (variable, kind) for the variables that were proven, as each problem is solved."""
+    keys = [_problem_key(job) for _, job in jobs]
+    todo = [job for key, (_, job) in zip(keys, jobs) if cache is None or key not in cache]
+    if pool is not None and len(todo)>1:
+        solved = pool.imap(_solve_problem, todo)
+    else:
+        solved = (_solve_problem(job, check) for job in todo)
+    for key, (variables, _) in zip(keys, jobs):
+        if check is not None:
+            check()
+        if cache is not None and key in cache:
+            solution = cache[key]
+            if stats is not None:
+                stats.add('cached')
+        else:
+            solution, info = next(solved)
+            if stats is not None:
+                stats.add('problems')
+                stats.add('invocations', info.pop('invocations', 0))
+                stats.add_times(info)
+        if new_cache is not None:
+            new_cache[key] = solution
+        for i, kind in solution:
+            yield variables[i], kind
+
+
+def _problem_key(job):
+    sizes, constraints, solver = job
+    return tuple(sizes), tuple((tuple(terms), lo, hi) for terms, lo, hi in constraints)
+
+
+def _solve_problem(job, check=None):
+    """Return a list of (variable, kind) for the variables of the problem that were proven
+    and a dict of measurements: seconds by phase and the number of 'invocations' of the solver"""
+    sizes, constraints, solver = job
+    info = {}
+    if isinstance(solver, NativeSolver):
+        solution = list(_solve_native(sizes, constraints, check, info))
+    else:
+        solution = list(_solve_milp(sizes, constraints, solver, check, info))
+    return solution, info
+
+
+def _solve_native(sizes, constraints, check=None, info=None):
+    # The same problem as below, but solved in-process by native.py:
+    # search for any solution and then for solutions where
+    # a class differs from it, until the classes that never differ are known.
+    if info is None:
+        info = {}
+    start = time.time()
+    problem = _native.Problem()
+    problem.check = check
+    for size in sizes:
+        problem.add_var(0, size)
+    for terms, lo, hi in constraints:
+        problem.add(terms, lo, hi)
+    info['model'] = time.time()-start
+
+    start = time.time()
+    backbone = problem.backbone()
+    info['search'] = time.time()-start
+    info['invocations'] = problem.searches
+
+    for v, count in backbone.items():
+        if count==sizes[v]:
+            yield v, Cell.full
+        elif count==0:
+            yield v, Cell.empty
+
+
+def _solve_milp(sizes, constraints, solver, check=None, info=None):
+    ####################################################
+    #     -- The MILP Problem (managed by PuLP) --
+    ####################################################
+
+    if info is None:
+        info = {}
+    start = time.time()
+    problem = LpProblem('HexcellsMILP', LpMinimize)
+
+    # For every equivalance class of cells there is a integer variable,
+    # modeling the number of blue cells in that class.
+    # The class is blue (or black) iff we can prove that the variable
+    # is necessarily the size of the class (or 0)
+    # This list maps a class number to the respective variable.
+    dic = [LpVariable('v'+str(i), lowBound = 0, upBound = size, cat = 'Integer') for i, size in enumerate(sizes)]
+
+    def get_var(i):
+        return dic[i]
+
+    for terms, lo, hi in constraints:
+        expr = lpSum(coef*get_var(i) for i, coef in terms)
+        if lo is not None and lo==hi:
+            problem += expr == lo
+            continue
+        if lo is not None:
+            problem += expr >= lo
+        if hi is not None:
+            problem += expr <= hi
 
     # First, get any solution.
     # Shitty default solver can't handle no objective, so invent one:
     spam = LpVariable('spam', 0, 1, 'binary')
     problem += (spam == 1)
     problem.setObjective(spam) # no optimisation function yet
+    info['model'] = time.time()-start
+    start = time.time()
     problem.solve(solver)
-    
+    info['first'] = time.time()-start
+    info['invocations'] = 1
+
     def get_true_false_classes():
         true_set  = set()
         false_set = set()
-        
-        for rep,size in classes.items():
-            if value(get_var(rep)) == 0:
-                false_set.add(rep)
-            elif value(get_var(rep)) == size:
-                true_set.add(rep)
+
+        for i,size in enumerate(sizes):
+            if value(get_var(i)) == 0:
+                false_set.add(i)
+            elif value(get_var(i)) == size:
+                true_set.add(i)
         return true_set, false_set
-    
+
     # get classes that are fully true or false
     # they are candidates for solvable classes
     T, F = get_true_false_classes()
-    
+
+    start = time.time()
     while T or F:
         # Now try to vary as much away from the
         # initial solution as possible:
         # We try to make the variables True, that were False before
         # and vice versa. If no change could be achieved, then
         # the remaining variables have their unique possible value.
+        if check is not None:
+            check()
         problem.setObjective(lpSum(get_var(t) for t in T) - lpSum(get_var(f) for f in F))
         problem.solve(solver)
-        
+        info['invocations'] += 1
+
         # all true variables stayed true and false stayed false?
         # Then they have their unique value and we are done!
-        if value(problem.objective) == sum(classes[rep] for rep in T):
-            for rep in T:
-                for cell in unknown:
-                    if repOf[cell] is rep:
-                        yield cell, Cell.full
-            for rep in F:
-                for cell in unknown:
-                    if repOf[cell] is rep:
-                        yield cell, Cell.empty
+        if value(problem.objective) == sum(sizes[i] for i in T):
+            info['narrowing'] = time.time()-start
+            for i in T:
+                yield i, Cell.full
+            for i in F:
+                yield i, Cell.empty
             return
-        
+
         T_new, F_new = get_true_false_classes()
-        
+
         # remember only those classes that subbornly kept their pure trueness/falseness
         T = T & T_new
         F = F & F_new
-            
-        
+
+
 #        # This old code handled the variables independently
 #        # creating tons of milps. The above solution tries
 #        # to find more information per call to the solver and
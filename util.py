@@ -18,27 +18,39 @@
 
 import math as _math
 import collections as _collections
+import os.path as _os_path
+
+
+script_path = _os_path.dirname(_os_path.abspath(__file__))
+
+def here(*args):
+    return _os_path.join(script_path, *args)
 
 
 def minmax(*args, **kwargs):
     return min(*args, **kwargs), max(*args, **kwargs)
 
 
-def all_grouped(items, key):
+def all_grouped(items, key=None, neighbors=None):
     """Are all the items in one group or not?
-    `key` should be a function that says whether 2 items are connected."""
+    `key` should be a function that says whether 2 items are connected.
+    Instead, `neighbors` can be a function that returns the items connected to one
+    (e.g. looked up in a grid), which is faster for many items."""
+    rest = set(items)
     try:
-        grouped = {next(iter(items))}
-    except StopIteration:
+        queue = [rest.pop()]
+    except KeyError:
         return True
-    anything_to_add = True
-    while anything_to_add:
-        anything_to_add = False
-        for a in items-grouped:
-            if any(key(a, b) for b in grouped):
-                anything_to_add = True
-                grouped.add(a)
-    return len(grouped)==len(items)
+    # Go through the group from any item, taking its items out of `rest`
+    while queue and rest:
+        a = queue.pop()
+        if neighbors is not None:
+            found = [b for b in neighbors(a) if b in rest]
+        else:
+            found = [b for b in rest if key(b, a)]
+        rest.difference_update(found)
+        queue.extend(found)
+    return not rest
 
 
 def distance(a, b, squared=False):